@@ -0,0 +1,3 @@
+"""
+Benchmarks of the layer update pipeline, see benchmarks.run
+"""
@@ -0,0 +1,304 @@
+"""
+Benchmarks of the layer update pipeline against local stub GWC, WMS and LayerInfo servers (see benchmarks.servers).
+
+For each time stop count, a GWC layer's TIME filter and its source are generated one time step apart (so every update
+adds one time stop, expires one and moves the default), then:
+
+    layerinfo, wms: a full gwc.update_layer() run against the stub servers, with the time of each phase recorded by
+        gwc.metrics
+    stages: the CPU bound steps on their own (GWC filter parse, capabilities parse, reconcile, XML update)
+
+and, once:
+
+    startup: cold start of a fresh interpreter importing gwc.gwc and running 'gwc --help', and which heavy
+        dependencies the import pulled in
+
+Wall time, CPU time (of the whole process, which includes the stub servers' threads), peak Python heap (from a separate
+traced run) and the process' peak RSS so far are reported for each.  Run from the repository root:
+
+    python -m benchmarks.run --sizes 10,1000,10000,100000 --repeat 3 --json bench.json
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+from lxml import etree
+
+from gwc import capabilities, gwc, metrics, timecodec, timeindex
+
+from . import servers
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+SIZES = "10,1000,10000,100000"
+CAPABILITIES_LAYERS = 1000
+REPEAT = 1
+STARTUP_REPEAT = 10
+LAYER_ID = "bench"
+# dependencies that should only be imported on the code paths that need them:
+HEAVY_MODULES = ('requests', 'lxml.etree', 'dateutil', 'concurrent.futures')
+
+
+def cpu_time():
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def max_rss_mb():
+    """
+    :return: peak resident set size of the process so far in MB (never decreases), or None if unknown
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS:
+    return rss / 1024.0 / (1024.0 if sys.platform == 'darwin' else 1.0)
+
+
+def measure(fn, repeat=REPEAT, setup=None):
+    """
+    :param fn: callable to measure
+    :param repeat: number of timed runs, the fastest is reported.  Peak memory is measured on one more run, since
+        tracing allocations slows everything down
+    :param setup: callable run (unmeasured) before each run
+    :return: tuple of (fn's result, dict of wall, cpu, peak_mb and max_rss_mb)
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        gc.collect()
+        wall, cpu = time.time(), cpu_time()
+        result = fn()
+        wall, cpu = time.time() - wall, cpu_time() - cpu
+        if best is None or wall < best[1]['wall']:
+            best = (result, {'wall': wall, 'cpu': cpu})
+    result, stats = best
+    stats['max_rss_mb'] = max_rss_mb()
+
+    stats['peak_mb'] = None
+    if tracemalloc is not None:
+        if setup is not None:
+            setup()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            stats['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+        finally:
+            tracemalloc.stop()
+    return result, stats
+
+
+class Quiet(object):
+    """
+    Discard stdout, update_layer() prints every time stop
+    """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def bench_update(name, size, state, base, source_args, repeat):
+    """
+    :return: list of result rows for a full update_layer() run and each of its phases
+    """
+    filter_times = servers.timestops(size)
+    layer = servers.layer_xml(LAYER_ID, filter_times)
+    args = gwc.build_parser().parse_args(['--layer_id', LAYER_ID, '--gwc_rest_url', base + '/gwc/rest'] + source_args)
+    recorders = []
+
+    def setup():
+        state.reset()
+        state.layers[LAYER_ID] = layer
+
+    def run():
+        recorder = metrics.Recorder(LAYER_ID)
+        recorders.append(recorder)
+        with Quiet():
+            return gwc.update_layer(args, recorder=recorder)
+
+    result, stats = measure(run, repeat=repeat, setup=setup)
+    if result['added'] != 1 or result['removed'] != 1:
+        raise AssertionError("Unexpected {name} update result: {result}".format(name=name, result=result))
+
+    rows = [row(name, size, 'end_to_end', stats)]
+    # phases of the fastest run:
+    recorder = min(recorders, key=lambda recorder: recorder.phases[-1]['seconds'])
+    for record in recorder.phases:
+        if record['phase'] != metrics.TOTAL:
+            rows.append(row(name, size, record['phase'], {'wall': record['seconds']}))
+    return rows
+
+
+def bench_stages(size, caps_layers, repeat):
+    """
+    :return: list of result rows for the CPU bound steps of an update, without any HTTP
+    """
+    filter_times = servers.timestops(size)
+    source_times = servers.timestops(size, offset=1)
+    layer = servers.layer_xml(LAYER_ID, filter_times)
+    caps = servers.capabilities_xml('1.3.0', source_times, layers=caps_layers)
+    formatter = timecodec.Formatter(timecodec.RFC3339)
+    rows = []
+
+    def parse_filter():
+        root = etree.fromstring(layer)
+        time_values = root.find("parameterFilters/stringParameterFilter/values")
+        return root, time_values, timeindex.index_filter_values(time_values)
+
+    (_, _, filter_index), stats = measure(parse_filter, repeat=repeat)
+    rows.append(row('stages', size, 'parse_filter', stats))
+
+    positions, stats = measure(lambda: capabilities.parse_time_positions(io.BytesIO(caps), servers.WMS_LAYER,
+                                                                         version='1.3.0'), repeat=repeat)
+    rows.append(row('stages', size, 'parse_capabilities', stats))
+
+    keys, stats = measure(lambda: timecodec.parse_many(positions), repeat=repeat)
+    rows.append(row('stages', size, 'parse_times', stats))
+
+    reconciliation, stats = measure(lambda: timeindex.reconcile(keys, filter_index), repeat=repeat)
+    rows.append(row('stages', size, 'reconcile', stats))
+
+    # apply_reconciliation() modifies the XML in place, so every run needs a freshly parsed filter:
+    parsed = []
+
+    def apply():
+        root, time_values, filter_index = parsed.pop()
+        default = root.find("parameterFilters/stringParameterFilter/defaultValue")
+        timeindex.apply_reconciliation(time_values, default, filter_index, reconciliation, formatter)
+        return etree.tostring(root, encoding="UTF-8")
+
+    _, stats = measure(apply, repeat=repeat, setup=lambda: parsed.append(parse_filter()))
+    rows.append(row('stages', size, 'apply_and_serialize', stats))
+    return rows
+
+
+def bench_startup(repeat):
+    """
+    :return: list of result rows for the cold start of a new interpreter, fastest of repeat runs each
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+    commands = [
+        ('python', "pass"),
+        ('import', "import gwc.gwc"),
+        ('help', "from gwc import gwc\ntry:\n    gwc.main(['--help'])\nexcept SystemExit:\n    pass"),
+    ]
+    rows = []
+    with open(os.devnull, 'w') as devnull:
+        for stage, code in commands:
+            best = None
+            for _ in range(max(STARTUP_REPEAT, repeat)):
+                wall = time.time()
+                subprocess.check_call([sys.executable, "-c", code], env=env, stdout=devnull)
+                wall = time.time() - wall
+                best = wall if best is None else min(best, wall)
+            rows.append(row('startup', '-', stage, {'wall': best}))
+
+    imported = subprocess.check_output([sys.executable, "-c", "import sys, gwc.gwc; print(' '.join(m for m in {modules!r} "
+                                        "if m in sys.modules))".format(modules=HEAVY_MODULES)], env=env)
+    print("Heavy modules imported by gwc.gwc: {modules}".format(modules=imported.decode("utf-8").strip() or "none"))
+    return rows
+
+
+def row(scenario, size, stage, stats):
+    result = {'scenario': scenario, 'timestops': size, 'stage': stage}
+    for key in ('wall', 'cpu', 'peak_mb', 'max_rss_mb'):
+        result[key] = stats.get(key)
+    return result
+
+
+def print_rows(rows):
+    print("{:<10} {:>9} {:<20} {:>10} {:>10} {:>10} {:>11}".format(
+        "scenario", "timestops", "stage", "wall (s)", "cpu (s)", "peak (MB)", "maxrss (MB)"))
+    for result in rows:
+        print("{scenario:<10} {timestops:>9} {stage:<20} {wall:>10} {cpu:>10} {peak:>10} {rss:>11}".format(
+            scenario=result['scenario'], timestops=result['timestops'], stage=result['stage'],
+            wall=_fmt(result['wall'], "{:.4f}"), cpu=_fmt(result['cpu'], "{:.4f}"),
+            peak=_fmt(result['peak_mb'], "{:.1f}"), rss=_fmt(result['max_rss_mb'], "{:.1f}")))
+    sys.stdout.flush()
+
+
+def _fmt(value, fmt):
+    return "-" if value is None else fmt.format(value)
+
+
+def main(argv=None):
+    kwargs = {
+        'prog': 'python -m benchmarks.run',
+        'description': 'Benchmark GWC layer updates against local stub GWC, WMS and LayerInfo servers.',
+    }
+    parser = argparse.ArgumentParser(**kwargs)
+    parser.add_argument('--sizes', type=str, default=SIZES,
+                        help='Comma separated time stop counts to benchmark.  Default: {sizes}'.format(sizes=SIZES))
+    parser.add_argument('--caps_layers', type=int, default=CAPABILITIES_LAYERS,
+                        help='Number of layers in the WMS capabilities document, the benchmarked layer last.  '
+                             'Default: {layers}'.format(layers=CAPABILITIES_LAYERS))
+    parser.add_argument('--scenarios', type=str, default='startup,layerinfo,wms,stages',
+                        help='Comma separated scenarios to run.  Default: startup,layerinfo,wms,stages')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='Runs of each benchmark, the fastest is reported.  Default: {repeat}'.format(
+                            repeat=REPEAT))
+    parser.add_argument('--json', type=str, required=False,
+                        help='File to write the results to as JSON')
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenarios.split(",")
+    rows = []
+    if 'startup' in scenarios:
+        rows += bench_startup(args.repeat)
+        print_rows(rows)
+
+    state = servers.StubState()
+    server, base = servers.start(state)
+    try:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            source_times = servers.timestops(size, offset=1)
+            results = []
+            if 'layerinfo' in scenarios:
+                state.layerinfo = servers.layerinfo_json(source_times)
+                results += bench_update('layerinfo', size, state, base,
+                                        ['--nc_layerinfo_url', base + '/layerinfo', '--nc_layers', '1'], args.repeat)
+            if 'wms' in scenarios:
+                state.capabilities = {'1.3.0': servers.capabilities_xml('1.3.0', source_times,
+                                                                        layers=args.caps_layers)}
+                results += bench_update('wms', size, state, base,
+                                        ['--wms_url', base + '/geoserver/wms', '--wms_layer', servers.WMS_LAYER],
+                                        args.repeat)
+                state.capabilities = {}
+            if 'stages' in scenarios:
+                results += bench_stages(size, args.caps_layers, args.repeat)
+            if results:
+                print_rows(results)
+            rows += results
+    finally:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Local stand-ins for the services a layer update talks to, served from a background thread in the benchmark process:
+
+    GeoWebCache REST API: GET/POST /gwc/rest/layers/<layer>.xml, GET/POST /gwc/rest/seed/<layer>[.json],
+        POST /gwc/rest/masstruncate, GET /gwc/service/wmts?request=GetTile
+    GeoServer-like WMS: GET /geoserver/wms?request=GetCapabilities (1.3.0 and 1.1.1)
+    nowCOAST LayerInfo Servlet: GET /layerinfo?request=timestops
+
+Responses are rendered once up front, so serving them adds as little as possible to the benchmark's own CPU time and
+memory.  Seed/truncate tasks are simulated as GWC 'long-array-array' task arrays that finish after task_duration
+seconds.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+START = datetime(2017, 9, 6, 13, 0, 0)
+STEP = timedelta(minutes=5)
+WMS_LAYER = "nowCOAST_Geo:ndfd_wind"
+CHUNK_SIZE = 64 * 1024
+
+LAYER_XML = (
+    '<wmsLayer><name>{name}</name><mimeFormats><string>image/png</string></mimeFormats>'
+    '<gridSubsets>'
+    '<gridSubset><gridSetName>EPSG:4326</gridSetName><extent><coords><double>-180.0</double><double>-90.0</double>'
+    '<double>180.0</double><double>90.0</double></coords></extent></gridSubset>'
+    '<gridSubset><gridSetName>EPSG:900913</gridSetName><extent><coords><double>-2.0E7</double><double>-2.0E7</double>'
+    '<double>2.0E7</double><double>2.0E7</double></coords></extent></gridSubset>'
+    '</gridSubsets>'
+    '<parameterFilters><stringParameterFilter><key>TIME</key><defaultValue>{default}</defaultValue>'
+    '<values>{values}</values></stringParameterFilter></parameterFilters>'
+    '<wmsUrl><string>http://localhost:8080/geoserver/wms</string></wmsUrl></wmsLayer>'
+)
+
+
+def timestops(count, offset=0):
+    """
+    :param count: number of time stops
+    :param offset: number of steps to shift the first time stop by
+    :return: list of datetimes, STEP apart
+    """
+    return [START + STEP * (i + offset) for i in range(count)]
+
+
+def rfc3339(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def epoch_millis(dt):
+    return int((dt - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def layer_xml(name, times):
+    """
+    :return: GWC layer config XML (bytes) with a TIME parameter filter holding times
+    """
+    values = "".join("<string>{time}</string>".format(time=rfc3339(dt)) for dt in times)
+    return LAYER_XML.format(name=name, default=rfc3339(times[-1]) if times else "", values=values).encode("utf-8")
+
+
+def capabilities_xml(version, times, layers=1, target=WMS_LAYER):
+    """
+    :param version: WMS version, '1.3.0' or '1.1.1'
+    :param times: time dimension values of the target layer
+    :param layers: total number of layers advertised, the target layer last
+    :param target: name of the target layer
+    :return: WMS GetCapabilities document (bytes)
+    """
+    if version == "1.3.0":
+        head = ('<?xml version="1.0" encoding="UTF-8"?><WMS_Capabilities version="1.3.0" '
+                'xmlns="http://www.opengis.net/wms"><Service><Name>WMS</Name></Service><Capability><Layer>'
+                '<Title>root</Title>')
+        dimension = '<Dimension name="time" default="current" units="ISO8601">{values}</Dimension>'
+        tail = '</Layer></Capability></WMS_Capabilities>'
+    else:
+        head = ('<?xml version="1.0" encoding="UTF-8"?><WMT_MS_Capabilities version="1.1.1"><Service>'
+                '<Name>OGC:WMS</Name></Service><Capability><Layer><Title>root</Title>')
+        dimension = '<Dimension name="time" units="ISO8601"/><Extent name="time" default="current">{values}</Extent>'
+        tail = '</Layer></Capability></WMT_MS_Capabilities>'
+
+    # other layers advertise a periodic interval, like most of a real server's time enabled layers:
+    other = dimension.format(values="2017-01-01T00:00:00.000Z/2017-12-31T23:00:00.000Z/PT1H")
+    parts = [head]
+    for i in range(layers - 1):
+        parts.append('<Layer queryable="1"><Name>nowCOAST_Geo:layer_{i}</Name><Title>Layer {i}</Title>'
+                     '<BoundingBox CRS="EPSG:4326" minx="-90" miny="-180" maxx="90" maxy="180"/>{dimension}'
+                     '</Layer>'.format(i=i, dimension=other))
+    parts.append('<Layer queryable="1"><Name>{name}</Name><Title>Target</Title>{dimension}</Layer>'.format(
+        name=target, dimension=dimension.format(values=",".join(rfc3339(dt) for dt in times))))
+    parts.append(tail)
+    return "".join(parts).encode("utf-8")
+
+
+def layerinfo_json(times):
+    """
+    :return: nowCOAST LayerInfo Servlet 'timestops' response (bytes) for layer '1'
+    """
+    return json.dumps({"layers": [{"id": 1, "timeStops": [epoch_millis(dt) for dt in times]}]}).encode("utf-8")
+
+
+class StubState(object):
+    """
+    Content served by the stub servers, and what the benchmarked update did to them
+    """
+
+    def __init__(self, task_duration=0.0):
+        """
+        :param task_duration: seconds each submitted seed/truncate task reports as running
+        """
+        self.task_duration = task_duration
+        self.lock = threading.Lock()
+        # layer id -> layer XML bytes, version -> capabilities bytes, LayerInfo bytes:
+        self.layers = {}
+        self.capabilities = {}
+        self.layerinfo = b'{"layers": []}'
+        # 'geowebcache-cache-result' header of the WMTS tiles served:
+        self.cache_result = "HIT"
+        # counters of what the update did:
+        self.posts = 0
+        self.seed_requests = 0
+        self.mass_truncates = 0
+        self.kills = 0
+        self.tile_requests = 0
+        self.tasks = []
+        self.task_id = 0
+
+    def reset(self):
+        with self.lock:
+            self.posts = self.seed_requests = self.mass_truncates = self.kills = self.tile_requests = 0
+            self.tasks = []
+
+    def running_tasks(self):
+        now = time.time()
+        with self.lock:
+            self.tasks = [task for task in self.tasks if task[1] > now]
+            return [[0, 100, int(end - now), task_id, 1] for task_id, end in self.tasks]
+
+    def submit_task(self):
+        with self.lock:
+            self.seed_requests += 1
+            self.task_id += 1
+            if self.task_duration > 0:
+                self.tasks.append((self.task_id, time.time() + self.task_duration))
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            layer = re.match(r'^/gwc/rest/layers/(.+)\.xml$', url.path)
+            if layer:
+                body = state.layers.get(layer.group(1))
+                return self._send(200, body, "text/xml") if body is not None else self._send(404, b"not found")
+            if re.match(r'^/gwc/rest/seed/.+\.json$', url.path):
+                return self._send(200, json.dumps({"long-array-array": state.running_tasks()}).encode("utf-8"),
+                                  "application/json")
+            if url.path.endswith("/wms"):
+                query = dict((key.lower(), values[0]) for key, values in parse_qs(url.query).items())
+                body = state.capabilities.get(query.get("version"))
+                if body is None:
+                    return self._send(400, b"<ServiceExceptionReport/>", "text/xml")
+                return self._send(200, body, "text/xml", chunked=True)
+            if url.path == "/gwc/service/wmts":
+                with state.lock:
+                    state.tile_requests += 1
+                return self._send(200, b"\x89PNG\r\n\x1a\n", "image/png",
+                                  headers={"geowebcache-cache-result": state.cache_result})
+            if url.path == "/layerinfo":
+                return self._send(200, state.layerinfo, "application/json")
+            self._send(404, b"not found")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            layer = re.match(r'^/gwc/rest/layers/(.+)\.xml$', url.path)
+            if layer:
+                with state.lock:
+                    state.layers[layer.group(1)] = body
+                    state.posts += 1
+                return self._send(200, b"layer updated", "text/plain")
+            if url.path == "/gwc/rest/masstruncate":
+                with state.lock:
+                    state.mass_truncates += 1
+                return self._send(200, b"", "text/plain")
+            if re.match(r'^/gwc/rest/seed/.+\.json$', url.path):
+                state.submit_task()
+                return self._send(200, b"", "text/plain")
+            if re.match(r'^/gwc/rest/seed/[^.]+$', url.path):
+                killed = parse_qs(body.decode("utf-8")).get("thread_id", [])
+                with state.lock:
+                    state.kills += len(killed)
+                    state.tasks = [task for task in state.tasks if str(task[0]) not in killed]
+                return self._send(200, b"", "text/plain")
+            self._send(404, b"not found")
+
+        def _send(self, status, body, content_type="text/plain", chunked=False, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            if chunked:
+                # stream large documents like a real server, so the client can stop reading early:
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for i in range(0, len(body), CHUNK_SIZE):
+                        chunk = body[i:i + CHUNK_SIZE]
+                        self.wfile.write("{size:x}\r\n".format(size=len(chunk)).encode("ascii") + chunk + b"\r\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (IOError, OSError):
+                    # the client closed the connection once it found its layer
+                    self.close_connection = True
+                return
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def start(state):
+    """
+    Serve state from a background thread on a free local port
+
+    :return: tuple of (server, base URL), stop the server with server.shutdown()
+    """
+    server = _Server(("127.0.0.1", 0), _handler(state))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:{port}".format(port=server.server_address[1])
@@ -0,0 +1,310 @@
+"""
+Batch mode: update many GWC layers from a single config file, running each layer's pipeline concurrently.
+
+The config file is JSON, with optional 'defaults' applied to every layer and a list of 'layers'.  Keys are the same
+as the single layer command line options (without the leading dashes), for example:
+
+    {
+        "defaults": {"gwc_rest_url": "http://localhost:8080/geowebcache/rest", "time_output_fmt": "iso8601"},
+        "layers": [
+            {"layer_id": "nexrad_reflectivity", "nc_service": "radar_meteo_imagery_nexrad_time", "nc_layers": "1"},
+            {"layer_id": "nowCOAST_Geo:ndfd_wind", "wms_url": "http://localhost:8070/geoserver/wms?",
+             "wms_layer": "nowCOAST_Geo:ndfd_wind"}
+        ]
+    }
+
+Layers whose sources are layers of the same nowCOAST LayerInfo service (same nc_layerinfo_url, nc_service and nc_fmt)
+share a single LayerInfo request for all of their nc_layers, and each GWC layer is updated with the time stops of its
+own nowCOAST layer.
+
+Each layer's options are parsed by the single layer command line parser, so values are converted and checked as on the
+command line and unknown keys are rejected.  Flags (eg. seed_adaptive) take true or false, repeatable options (eg.
+gridset_zoom) a list, and gwc_rest_url either a comma separated string or a list.  log_file and output only apply to the
+single layer command line and are rejected (batch and watch mode take --log_file themselves).  Layers with the same
+timeout, retries and backoff share a pooled HTTP client.
+"""
+import argparse
+import copy
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import client, gwc, metrics
+
+WORKERS = 4
+# single layer command line options that batch/watch configs can't set:
+CLI_ONLY_OPTIONS = ('log_file', 'output')
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    """
+    Command line interface for 'gwc batch'
+    """
+    kwargs = {
+        'prog': 'gwc batch',
+        'description': 'Update the time parameter filters of many GWC layers listed in a JSON config file.',
+        'formatter_class': argparse.RawDescriptionHelpFormatter,
+    }
+    parser = argparse.ArgumentParser(**kwargs)
+    parser.add_argument('config', type=str,
+                        help='JSON config file mapping GWC layer IDs to their WMS or LayerInfo sources')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, required=False,
+                        help='Maximum number of layers to update concurrently.  Default: {workers}'.format(workers=WORKERS))
+    parser.add_argument('--log_file', type=str, default=gwc.LOG, required=False,
+                        help='Log file to append to.  Default: {log}'.format(log=gwc.LOG))
+    args = parser.parse_args(argv)
+    gwc.configure_logging(args.log_file)
+
+    try:
+        _, layers = load_config(args.config)
+    except (IOError, ValueError) as e:
+        print("Unable to read batch config file: {file}.  Err: {err}".format(file=args.config, err=e))
+        exit(1)
+
+    # one pooled HTTP client per HTTP setting, with enough keep-alive connections per host for each worker:
+    http_clients = HTTPClients(layers, pool_size=max(client.POOL_SIZE, args.workers))
+    try:
+        results = run_batch(layers, workers=args.workers, http_client=http_clients)
+    finally:
+        http_clients.close()
+    print_summary(results)
+
+    if any(result['error'] for result in results):
+        exit(2)
+
+
+def load_config(filename, extra_options=None):
+    """
+    :param filename: path to the JSON batch config file
+    :param extra_options: dict of option name -> type callable, for options the caller accepts on top of the single
+        layer command line options (eg. watch mode's 'interval').  Default: none
+    :return: tuple of (defaults, layers): an argparse.Namespace holding the command line defaults updated with the
+        config 'defaults', and a list of argparse.Namespace objects, one per layer, holding the layer's options merged
+        over those defaults
+    :raises ValueError: if the config isn't valid JSON, or holds an unknown option or a value the command line would
+        reject
+    """
+    with io.open(filename, mode="rt", encoding="utf-8") as f:
+        config = json.load(f)
+
+    parser = gwc.build_parser()
+    # report invalid options as config errors instead of printing usage and exiting:
+    parser.error = _reject
+    defaults = config.get('defaults', {})
+    layers = []
+    for layer in config['layers']:
+        if 'layer_id' not in layer:
+            raise ValueError("Batch config layer entry is missing 'layer_id': {layer}".format(layer=layer))
+        layers.append(_namespace(parser, layer['layer_id'], [defaults, layer], extra_options or {}))
+    return _namespace(parser, None, [defaults], extra_options or {}), layers
+
+
+def _reject(message):
+    raise ValueError(message)
+
+
+def _namespace(parser, layer_id, options, extra_options):
+    """
+    :param parser: gwc.build_parser() to parse the options with
+    :param layer_id: GWC layer ID, or None for the config defaults
+    :param options: list of option dicts, later ones overriding earlier ones
+    :param extra_options: dict of option name -> type callable, for options the parser doesn't know
+    :return: argparse.Namespace of the options over the command line defaults
+    :raises ValueError: for unknown options or values the parser rejects
+    """
+    actions = dict((action.dest, action) for action in parser._actions
+                   if action.option_strings and not isinstance(action, argparse._HelpAction))
+    merged = {}
+    for option in options:
+        merged.update(option)
+    merged['layer_id'] = layer_id or ''
+
+    argv, extra = [], {}
+    try:
+        for key, value in sorted(merged.items()):
+            if key in extra_options:
+                extra[key] = extra_options[key](value)
+                continue
+            if key in CLI_ONLY_OPTIONS:
+                raise ValueError("option {key} only applies to the single layer command line".format(key=key))
+            action = actions.get(key)
+            if action is None:
+                raise ValueError("unknown option: {key}".format(key=key))
+            if value is None:
+                continue
+            flag = action.option_strings[-1]
+            if action.nargs == 0:
+                if not isinstance(value, bool):
+                    raise ValueError("option {key} takes true or false, not: {value}".format(key=key, value=value))
+                if value:
+                    argv.append(flag)
+            elif isinstance(value, list) and isinstance(action, argparse._AppendAction):
+                argv.extend("{flag}={value}".format(flag=flag, value=item) for item in value)
+            elif isinstance(value, list) and key == 'gwc_rest_url':
+                argv.append("{flag}={value}".format(flag=flag, value=",".join(value)))
+            elif isinstance(value, (bool, list, dict)):
+                raise ValueError("invalid value for option {key}: {value}".format(key=key, value=value))
+            else:
+                argv.append("{flag}={value}".format(flag=flag, value=value))
+        args = parser.parse_args(argv)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid batch config options for {layer}: {err}".format(
+            layer="GWC layer: {layer}".format(layer=layer_id) if layer_id else "defaults", err=e))
+    for key, value in extra.items():
+        setattr(args, key, value)
+    return args
+
+
+class HTTPClients(object):
+    """
+    One pooled client.HTTPClient per distinct HTTP setting (timeout, retries and backoff) of a set of layers
+    """
+
+    def __init__(self, layers, pool_size=client.POOL_SIZE):
+        """
+        :param layers: list of argparse.Namespace layer options, see load_config()
+        :param pool_size: maximum number of keep-alive connections kept open per host by each client
+        """
+        self.clients = {}
+        for layer in layers:
+            if http_settings(layer) not in self.clients:
+                self.clients[http_settings(layer)] = client.from_args(layer, pool_size=pool_size)
+
+    def get(self, layer):
+        """
+        :return: the client.HTTPClient for layer's HTTP settings
+        """
+        return self.clients[http_settings(layer)]
+
+    def close(self):
+        for http_client in self.clients.values():
+            http_client.close()
+
+
+def http_settings(layer):
+    """
+    :return: tuple of the (timeout, retries, backoff) options of layer
+    """
+    return layer.timeout, layer.retries, layer.backoff
+
+
+def layer_client(http_client, layer):
+    """
+    :param http_client: client.HTTPClient, or HTTPClients to pick layer's client from
+    :return: the client.HTTPClient to update layer with
+    """
+    return http_client.get(layer) if isinstance(http_client, HTTPClients) else http_client
+
+
+def run_batch(layers, workers=WORKERS, http_client=None):
+    """
+    Run the update pipeline for each layer concurrently on a bounded worker pool
+
+    :param layers: list of argparse.Namespace layer options, see load_config()
+    :param workers: maximum number of layers to update concurrently
+    :param http_client: client.HTTPClient shared by every layer, or HTTPClients to pick each layer's client from.
+        Default: the shared default client
+    :return: list of per-layer result dicts (in the order of layers), each with 'layer_id', 'elapsed' and 'error'
+        keys plus the update summary from gwc.update_layer() if it succeeded
+    """
+    if http_client is None:
+        http_client = client.default_client()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # the shared LayerInfo requests are queued ahead of every layer, so a layer waiting on one never holds up
+        # the worker it needs:
+        sources = {}
+        for key, group in layerinfo_groups(layers).items():
+            source = executor.submit(fetch_layerinfo_group, group, layer_client(http_client, group[0]))
+            for layer in group:
+                sources[id(layer)] = source
+        futures = [executor.submit(_run_layer, layer, layer_client(http_client, layer), sources.get(id(layer)))
+                   for layer in layers]
+        return [future.result() for future in futures]
+
+
+def layerinfo_groups(layers):
+    """
+    :param layers: list of argparse.Namespace layer options
+    :return: dict of (nc_layerinfo_url, nc_service, nc_fmt, HTTP settings) -> list of the layers that query that
+        LayerInfo service (with the same HTTP client), for the services queried by more than one layer
+    """
+    groups = {}
+    for layer in layers:
+        if layer.wms_url is None and gwc.nc_layer(layer) is not None:
+            key = (layer.nc_layerinfo_url, layer.nc_service, layer.nc_fmt, http_settings(layer))
+            groups.setdefault(key, []).append(layer)
+    return dict((key, group) for key, group in groups.items() if len(group) > 1)
+
+
+def fetch_layerinfo_group(group, http_client):
+    """
+    Query a LayerInfo service once for the nowCOAST layers of every GWC layer in group
+
+    :param group: list of argparse.Namespace layer options sharing a LayerInfo service, see layerinfo_groups()
+    :param http_client: client.HTTPClient to send the request through
+    :return: tuple of (metrics.Recorder of the source query/parse, dict of nowCOAST layer id -> time stops)
+    """
+    args = copy.copy(group[0])
+    nc_layers = []
+    for layer in group:
+        if gwc.nc_layer(layer) not in nc_layers:
+            nc_layers.append(gwc.nc_layer(layer))
+    args.nc_layers = ",".join(nc_layers)
+
+    recorder = metrics.Recorder(args.nc_service)
+    with recorder.phase(metrics.SOURCE_QUERY) as phase:
+        r = gwc.query_layerinfo(args, http_client)
+        phase.update(status=r.status_code, bytes=len(r.content))
+    with recorder.phase(metrics.SOURCE_PARSE) as phase:
+        timestops = gwc.parse_layerinfo_layers(r)
+        phase.update(timestops=sum(len(keys) for keys in timestops.values()))
+    print("Queried NC LayerInfo service: {service} once for {count} GWC layers".format(service=args.nc_service,
+                                                                                    count=len(group)))
+    return recorder, timestops
+
+
+def _run_layer(layer, http_client, source=None):
+    start = time.time()
+    result = {'layer_id': layer.layer_id, 'error': None}
+    try:
+        timestops, recorder = None, None
+        if source is not None:
+            shared, layer_timestops = source.result()
+            if gwc.nc_layer(layer) not in layer_timestops:
+                raise gwc.UpdateError("NC LayerInfo response has no layer: {nc_layer}".format(nc_layer=gwc.nc_layer(layer)))
+            timestops = layer_timestops[gwc.nc_layer(layer)]
+            # every layer of the group reports the shared source phases:
+            recorder = metrics.Recorder(layer.layer_id)
+            recorder.phases.extend(dict(record) for record in shared.phases)
+        result.update(gwc.update_layer(layer, http_client=http_client, timestops=timestops, recorder=recorder))
+    except Exception as e:
+        logger.exception("Update failed for GWC layer: {layer}".format(layer=layer.layer_id))
+        result['error'] = "{type}: {err}".format(type=type(e).__name__, err=e)
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def print_summary(results):
+    """
+    :param results: list of per-layer result dicts, as returned by run_batch()
+    """
+    print("Batch summary:")
+    for result in results:
+        if result['error']:
+            print("  {layer}: FAILED in {elapsed:.1f}s.  Err: {err}".format(layer=result['layer_id'],
+                                                                          elapsed=result['elapsed'],
+                                                                          err=result['error']))
+        else:
+            print("  {layer}: {path} in {elapsed:.1f}s.  added: {added}, removed: {removed}, default: {default}, "
+                  "truncate jobs: {truncated}, seed jobs: {seeded}".format(
+                      layer=result['layer_id'], path=result['path'], elapsed=result['elapsed'], added=result['added'],
+                      removed=result['removed'], default=result['default'], truncated=result['truncated'],
+                      seeded=result['seeded']))
+    failed = len([result for result in results if result['error']])
+    print("{ok} of {total} layers updated, {failed} failed".format(ok=len(results) - failed, total=len(results),
+                                                                 failed=failed))
@@ -0,0 +1,184 @@
+"""
+Streaming extraction of a single layer's TIME dimension values from a WMS GetCapabilities document.
+
+The document is parsed incrementally straight off the HTTP response with lxml's iterparse, discarding each element
+once it's been read and closing the connection as soon as the target layer's time values are found, so memory use and
+latency don't grow with the number of layers the server advertises.
+"""
+import logging
+import threading
+
+import requests
+
+try:
+    from urllib.parse import urlparse, urlunparse  # Python 3
+except ImportError:
+    from urlparse import urlparse, urlunparse  # Python 2
+
+VERSIONS = ('1.3.0', '1.1.1')
+SCOPES = ('none', 'namespace', 'layer')
+CAPABILITIES_ROOTS = {'1.3.0': 'WMS_Capabilities', '1.1.1': 'WMT_MS_Capabilities'}
+
+logger = logging.getLogger(__name__)
+
+# WMS version last known to work for each URL, so later queries skip the 1.3.0 -> 1.1.1 fallback:
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+class CapabilitiesError(Exception):
+    """
+    Raised when a URL doesn't return a usable WMS GetCapabilities document
+    """
+
+
+def get_time_positions(http_client, wms_url, wms_layer, scope='none', stats=None):
+    """
+    :param http_client: client.HTTPClient to send requests through
+    :param wms_url: WMS URL to query
+    :param wms_layer: name of the WMS layer whose time dimension values to return
+    :param scope: one of 'none', 'namespace' or 'layer'.  Request a GeoServer workspace ('namespace') or layer scoped
+        ('layer') capabilities document for wms_layer first, falling back to wms_url if the server doesn't allow it
+    :param stats: optional dict to set the 'status' and 'bytes' (read before the layer was found) of the capabilities
+        response used on
+    :return: list of time position strings advertised for wms_layer (empty if the layer or its time dimension wasn't
+        found)
+    :raises CapabilitiesError: if wms_url isn't WMS 1.3.0 or 1.1.1 compliant
+    """
+    scoped = scoped_url(wms_url, wms_layer, scope)
+    if scoped != wms_url:
+        try:
+            positions = _get_time_positions(http_client, scoped, wms_layer, stats)
+            if positions is not None:
+                return positions
+            logger.info("Layer {layer} not found in scoped WMS capabilities: {url}".format(layer=wms_layer, url=scoped))
+        except Exception as e:
+            logger.info("Scoped WMS capabilities request failed: {url}.  Err: {err}".format(url=scoped, err=e))
+
+    positions = _get_time_positions(http_client, wms_url, wms_layer, stats)
+    return positions if positions is not None else []
+
+
+def scoped_url(wms_url, wms_layer, scope):
+    """
+    :param wms_url: WMS URL, eg. http://localhost:8080/geoserver/wms?
+    :param wms_layer: prefixed WMS layer name, eg. nowCOAST_Geo:ndfd_wind
+    :param scope: one of 'none', 'namespace' or 'layer'
+    :return: the GeoServer virtual service URL for the layer's workspace ('namespace'), or for the layer alone
+        ('layer'), eg. http://localhost:8080/geoserver/nowCOAST_Geo/ndfd_wind/wms?.  wms_url if scope is 'none' or the
+        URL or layer name don't allow it
+    """
+    if scope == 'none' or ':' not in wms_layer:
+        return wms_url
+    parts = urlparse(wms_url)
+    path = parts.path.rstrip('/')
+    if not path.endswith('/wms'):
+        return wms_url
+    workspace, name = wms_layer.split(':', 1)
+    prefix = [workspace] if scope == 'namespace' else [workspace, name]
+    path = '/'.join([path[:-len('/wms')]] + prefix + ['wms'])
+    return urlunparse(parts._replace(path=path))
+
+
+def _get_time_positions(http_client, url, wms_layer, stats=None):
+    # try the version last known to work for this URL first:
+    with _versions_lock:
+        known = _versions.get(url)
+    versions = [known] + [version for version in VERSIONS if version != known] if known else list(VERSIONS)
+
+    errors = []
+    for version in versions:
+        try:
+            positions = _stream_time_positions(http_client, url, version, wms_layer, stats)
+        except CapabilitiesError as e:
+            if version != versions[-1]:
+                logger.info("WMS URL: {url} is not {version} compliant, falling back.  Err: {err}".format(
+                    url=url, version=version, err=e))
+            errors.append(e)
+            continue
+        with _versions_lock:
+            _versions[url] = version
+        return positions
+
+    raise CapabilitiesError("WMS URL: {url} is not {versions} compliant.  Err: {err}".format(
+        url=url, versions=" or ".join(VERSIONS), err=errors[-1]))
+
+
+def _stream_time_positions(http_client, url, version, wms_layer, stats=None):
+    from lxml import etree
+    params = {'service': 'WMS', 'request': 'GetCapabilities', 'version': version}
+    try:
+        r = http_client.get(url, params=params, stream=True)
+    except requests.exceptions.HTTPError as e:
+        # some servers reject GetCapabilities for a version they don't support with an error status:
+        raise CapabilitiesError(e)
+    try:
+        r.raw.decode_content = True
+        return parse_time_positions(r.raw, wms_layer, version=version)
+    except etree.XMLSyntaxError as e:
+        raise CapabilitiesError(e)
+    finally:
+        if stats is not None:
+            stats['status'] = r.status_code
+            stats['bytes'] = r.raw.tell()
+        # stop downloading the rest of the document once the layer's been found:
+        r.close()
+
+
+def parse_time_positions(source, wms_layer, version=None):
+    """
+    Incrementally parse a WMS GetCapabilities document until the time dimension values of wms_layer are found
+
+    :param source: file-like object (or filename) to parse the capabilities document from
+    :param wms_layer: name of the WMS layer whose time dimension values to return.  Also matched without its
+        workspace prefix, since GeoServer virtual services advertise unprefixed layer names
+    :param version: WMS version the document was requested as, to check against the document root element
+    :return: list of time position strings for wms_layer, or None if the layer wasn't found
+    :raises CapabilitiesError: if the document isn't a WMS capabilities document of the requested version
+    """
+    from lxml import etree
+    names = set([wms_layer, wms_layer.split(':', 1)[-1]])
+
+    # one entry per open <Layer>: [name, time values (own or inherited from the parent layer)]
+    layers = []
+    root_checked = False
+    for event, elem in etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+        tag = etree.QName(elem).localname
+
+        if event == 'start':
+            if not root_checked:
+                root_checked = True
+                if tag not in CAPABILITIES_ROOTS.values() or (version and tag != CAPABILITIES_ROOTS[version]):
+                    raise CapabilitiesError("Unexpected capabilities document root element: {tag}".format(tag=tag))
+            if tag == 'Layer':
+                layers.append([None, layers[-1][1] if layers else None])
+            continue
+
+        if layers:
+            parent = elem.getparent()
+            parent_tag = etree.QName(parent).localname if parent is not None else None
+            if tag == 'Name' and parent_tag == 'Layer':
+                layers[-1][0] = (elem.text or '').strip()
+            elif tag in ('Dimension', 'Extent') and parent_tag == 'Layer' and \
+                    elem.get('name', '').lower() == 'time' and (elem.text or '').strip():
+                # WMS 1.3.0 holds the values in <Dimension>, WMS 1.1.1 in <Extent>:
+                layers[-1][1] = elem.text
+                if layers[-1][0] in names:
+                    return _split_time_positions(elem.text)
+            elif tag == 'Layer':
+                name, time_text = layers.pop()
+                if name in names:
+                    return _split_time_positions(time_text)
+
+        # discard everything already read, keeping only the open ancestors of the current element:
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return None
+
+
+def _split_time_positions(text):
+    if not text:
+        return []
+    return [position.strip() for position in text.split(',') if position.strip()]
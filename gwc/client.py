@@ -0,0 +1,115 @@
+"""
+Shared HTTP client for GWC REST, WMS and LayerInfo traffic.
+
+A single requests.Session is reused for every request so connections are kept alive and pooled per host, with
+default timeouts and bounded retry with exponential backoff on 5xx responses and connection errors/resets.  POSTs
+(eg. GWC seed requests) aren't idempotent, so they're only retried when the connection failed before the request was
+sent, never after a read timeout or an error response.
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+TIMEOUT = 30
+RETRIES = 3
+BACKOFF = 0.5
+POOL_SIZE = 10
+RETRY_STATUS = (500, 502, 503, 504)
+# methods retried after the request was sent (read errors and RETRY_STATUS responses):
+RETRY_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPClient(object):
+    """
+    Thread-safe wrapper around a pooled, retrying requests.Session
+    """
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, pool_size=POOL_SIZE):
+        """
+        :param timeout: default timeout (seconds) for connecting to and reading from a server
+        :param retries: maximum number of retries per request on connection errors and 5xx responses (POSTs: on
+            connect errors only)
+        :param backoff: backoff factor (seconds) between retries, doubled after each attempt
+        :param pool_size: maximum number of keep-alive connections kept open per host
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=_retry(retries, backoff))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        :param method: one of 'get', 'put', 'post', 'delete'
+        :param url: URL to request
+        :param kwargs: passed on to requests.Session.request (params, data, json, auth, ...)
+        :return: the requests response object
+        :raises requests.exceptions.RequestException: if the request fails after retries, or returns an error status
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        r = self.session.request(method.upper(), url, **kwargs)
+        r.raise_for_status()
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("delete", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def _retry(retries, backoff):
+    kwargs = {
+        'total': retries,
+        'connect': retries,
+        'read': retries,
+        'status': retries,
+        'backoff_factor': backoff,
+        'status_forcelist': RETRY_STATUS,
+        # let raise_for_status() report the final error response rather than urllib3's MaxRetryError:
+        'raise_on_status': False,
+    }
+    try:
+        return Retry(allowed_methods=frozenset(RETRY_METHODS), **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(RETRY_METHODS), **kwargs)
+
+
+def from_args(args, pool_size=POOL_SIZE):
+    """
+    :param args: argparse.Namespace holding 'timeout', 'retries' and 'backoff' options
+    :param pool_size: maximum number of keep-alive connections kept open per host
+    :return: a new HTTPClient configured from args
+    """
+    return HTTPClient(timeout=args.timeout, retries=args.retries, backoff=args.backoff, pool_size=pool_size)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """
+    :return: the process-wide HTTPClient with default settings, created on first use
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
@@ -7,14 +7,14 @@ import sys
 import time
 import json
 import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from lxml import etree
-from owslib.wms import WebMapService
 
-from datetime import datetime, timedelta
-import dateutil
 #import pendulum
 
+from . import capabilities, client, metrics, monitor, seeding, state, timecodec, timeindex, timeranges, verify
+
 try:
     from urllib.parse import urlparse  # Python 3
 except ImportError:
@@ -27,20 +27,44 @@ NC_LAYERINFO_DEF_SERVICE = "radar_meteo_imagery_nexrad_time"
 NC_LAYERINFO_DEF_FORMAT = "json"
 WMS_URL = "http://localhost.kachina:8070/geoserver/wms?"
 TIME_OUTPUT_FMT = "rfc3339"
+GWC_USER = "geowebcache"
+GWC_PASSWORD = "secured"
 OUTPUT = "gwc.out"
 LOG = "gwc.log"
+# threads per layer update for the source query and GWC seed/truncate requests that run alongside the main pipeline:
+PIPELINE_WORKERS = 4
 
-# logging:
+# logging (configured by the command line entry points, see configure_logging()):
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-log = logging.FileHandler(LOG, mode='w')
-log.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
-logger.addHandler(log)
 
 
-def main():
+class UpdateError(Exception):
     """
-    Command line interface
+    Raised when a GWC layer update can't be completed
+    """
+
+
+def configure_logging(filename=LOG):
+    """
+    Log every gwc module's messages to filename, appending to it.  Called from the command line entry points only, so
+    importing gwc has no side effects
+
+    :param filename: log file to append to
+    """
+    package_logger = logging.getLogger(__package__ or "gwc")
+    package_logger.setLevel(logging.INFO)
+    path = os.path.abspath(filename)
+    for handler in package_logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == path:
+            return
+    log = logging.FileHandler(filename, mode='a')
+    log.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    package_logger.addHandler(log)
+
+
+def build_parser():
+    """
+    :return: the argparse.ArgumentParser for a single layer update
     """
     kwargs = {
         'description': 'Simple command line tool to pass a GWC layer identifier to update.',
@@ -52,13 +76,20 @@ def main():
     parser.add_argument('-l', '--layer_id', type=str, required=True,
                         help='GWC layer ID (REST API) to update')
     parser.add_argument('--gwc_rest_url', type=str, default=GWC_REST_URL, required=False,
-                        help='GWC REST API URL.  Default: {gwc_rest_url}'.format(gwc_rest_url=GWC_REST_URL))
+                        help='GWC REST API URL, or a comma separated list of the REST API URLs of clustered GWC nodes '
+                             '(the layer config is read from the first and pushed to all).  Default: {gwc_rest_url}'.format(
+                                 gwc_rest_url=GWC_REST_URL))
+    parser.add_argument('--gwc_user', type=str, default=GWC_USER, required=False,
+                        help='GWC REST API user name.  Default: {gwc_user}'.format(gwc_user=GWC_USER))
+    parser.add_argument('--gwc_password', type=str, default=GWC_PASSWORD, required=False,
+                        help='GWC REST API password.')
 
 
     parser.add_argument('--nc_layerinfo_url', type=str, default=NC_LAYERINFO_URL, required=False,
                         help='nowCOAST LayerInfo service URL.  Default: {nc_layerinfo_url}'.format(nc_layerinfo_url=NC_LAYERINFO_URL))
     parser.add_argument('--nc_layers', type=str, required=False,
-                        help='Comma separated list of layer(s) in the nowCOAST service to query')
+                        help='Comma separated list of layer(s) in the nowCOAST service to query, the time stops of '
+                             'the first are applied to the GWC layer')
     parser.add_argument('--nc_req', type=str, default=NC_LAYERINFO_DEF_REQUEST, required=False,
                         help='nowCOAST LayerInfo service request type.  Default: {nc_req}'.format(nc_req=NC_LAYERINFO_DEF_REQUEST))
     parser.add_argument('--nc_service', type=str, default=NC_LAYERINFO_DEF_SERVICE, required=False,
@@ -71,20 +102,141 @@ def main():
 
     parser.add_argument('--wms_layer', type=str, required=False,
                         help='The id of the WMS layer we will query to discover available time values')
+    parser.add_argument('--wms_scope', type=str, choices=capabilities.SCOPES, default='none', required=False,
+                        help='Request GeoServer workspace (\'namespace\') or \'layer\' scoped WMS capabilities for '
+                             'wms_layer, falling back to the full document if unavailable.  Default: none')
 
     parser.add_argument('--time_output_fmt', type=str, choices=set(("rfc3339", "iso8601")), default=TIME_OUTPUT_FMT, required=False,
                         help='Timestamp output format.  One of \'rfc3339\' or \'iso8601\' Default: {time_output_fmt}'.format(
                             time_output_fmt=TIME_OUTPUT_FMT))
 
+    # retention window of the TIME filter, relative to the newest source time:
+    parser.add_argument('--retain_count', type=int, required=False,
+                        help='Keep at most this many of the newest source times in the GWC TIME filter, older ones are '
+                             'removed and truncated.  Default: no limit')
+    parser.add_argument('--retain_age', type=str, required=False,
+                        help='Keep only the source times within this ISO8601 duration (eg. P7D, PT6H) of the newest in '
+                             'the GWC TIME filter, older ones are removed and truncated.  Default: no limit')
+
+    parser.add_argument('--log_file', type=str, default=LOG, required=False,
+                        help='Log file to append to.  Default: {log}'.format(log=LOG))
     parser.add_argument('-o', '--output', type=str, required=False, default=OUTPUT,
                         help='Output filename (path to a file to output results to).  Default: {out}'.format(out=OUTPUT))
 
+    # seeding/truncation:
+    parser.add_argument('--gridsets', type=str, required=False,
+                        help='Comma separated list of gridsets to seed/truncate.  Default: all gridSubsets of the layer')
+    parser.add_argument('--seed_zoom', type=str, default=seeding.SEED_ZOOM, required=False,
+                        help='Seed zoom range START-STOP.  Default: {zoom}'.format(zoom=seeding.SEED_ZOOM))
+    parser.add_argument('--gridset_zoom', type=str, action='append', required=False,
+                        help='Seed zoom range for a single gridset, GRIDSET=START-STOP.  May be repeated')
+    parser.add_argument('--truncate_zoom', type=str, default=seeding.TRUNCATE_ZOOM, required=False,
+                        help='Truncate zoom range START-STOP.  Default: {zoom}'.format(zoom=seeding.TRUNCATE_ZOOM))
+    parser.add_argument('--seed_thread_count', type=int, default=seeding.SEED_THREAD_COUNT, required=False,
+                        help='GWC threads per seed task.  Default: {count}'.format(count=seeding.SEED_THREAD_COUNT))
+    parser.add_argument('--truncate_thread_count', type=int, default=seeding.TRUNCATE_THREAD_COUNT, required=False,
+                        help='GWC threads per truncate task.  Default: {count}'.format(count=seeding.TRUNCATE_THREAD_COUNT))
+    parser.add_argument('--seed_thread_budget', type=int, default=seeding.SEED_THREAD_BUDGET, required=False,
+                        help='Maximum GWC threads across the layer\'s concurrently running tasks.  Default: {budget}'.format(
+                            budget=seeding.SEED_THREAD_BUDGET))
+    parser.add_argument('--seed_adaptive', action='store_true', required=False,
+                        help='Adapt the threadCount of later seed jobs to the tile throughput GWC reports during the run, '
+                             'starting from --seed_thread_count and within --seed_thread_budget')
+    parser.add_argument('--seed_max_latency', type=float, required=False,
+                        help='With --seed_adaptive, ceiling in seconds on the render latency per tile (running seed '
+                             'threads over tiles/s) to cut the threadCount at.  Default: none, maximize tiles/s')
+    parser.add_argument('--truncate_mode', type=str, default=seeding.TRUNCATE_ORPHANS, choices=seeding.TRUNCATE_MODES,
+                        required=False,
+                        help='How expired time caches are truncated: one GWC masstruncate request for every orphaned '
+                             'parameter cache (\'orphans\', GWC 1.12+), one masstruncate request per expired time '
+                             '(\'parameters\') or one truncate seed task per expired time and gridset (\'seed\').  '
+                             'Falls back in that order if GWC rejects a request.  Default: {mode}'.format(
+                                 mode=seeding.TRUNCATE_ORPHANS))
+    parser.add_argument('--seed_tile_budget', type=int, required=False,
+                        help='Most tiles to seed per update: the seed jobs are cut back to the deepest zoom level (up to '
+                             'the --seed_zoom/--gridset_zoom ranges) whose estimated tiles fit.  Default: no budget')
+    parser.add_argument('--seed_time_budget', type=float, required=False,
+                        help='Seconds the seeding of an update should take at --seed_rate, eg. the source\'s update '
+                             'interval.  Combined with --seed_tile_budget, the smaller budget applies.  Default: no budget')
+    parser.add_argument('--seed_rate', type=float, required=False,
+                        help='Expected GWC seeding throughput in tiles/s, to turn --seed_time_budget into tiles')
+    parser.add_argument('--tile_format', type=str, default=seeding.TILE_FORMAT, required=False,
+                        help='Tile format to seed/truncate.  Default: {fmt}'.format(fmt=seeding.TILE_FORMAT))
+    parser.add_argument('--seed_timeout', type=float, required=False,
+                        help='Deadline in seconds for this run\'s truncate/seed tasks, after which they are killed '
+                             'and the update fails.  Default: none')
+    parser.add_argument('--seed_poll_max', type=float, default=monitor.MAX_POLL_INTERVAL, required=False,
+                        help='Longest time in seconds between seed status polls.  Default: {interval}'.format(
+                            interval=monitor.MAX_POLL_INTERVAL))
+
+    # post-seed cache verification:
+    parser.add_argument('--verify_samples', type=int, default=0, required=False,
+                        help='Tiles to request from GWC for each seeded TIME value (and the default cache) after seeding, '
+                             'to check they\'re cached and served quickly.  Default: 0, no verification')
+    parser.add_argument('--verify_url', type=str, required=False,
+                        help='GWC WMTS endpoint to request the verification tiles from, eg. behind the load balancer.  '
+                             'Default: service/wmts next to each GWC REST API URL')
+    parser.add_argument('--verify_workers', type=int, default=verify.WORKERS, required=False,
+                        help='Maximum verification tile requests in flight.  Default: {workers}'.format(
+                            workers=verify.WORKERS))
+    parser.add_argument('--verify_min_hit_ratio', type=float, default=verify.MIN_HIT_RATIO, required=False,
+                        help='Lowest cache hit ratio of the verification tiles for the update to pass.  Default: {ratio}'.format(
+                            ratio=verify.MIN_HIT_RATIO))
+    parser.add_argument('--verify_max_latency', type=float, required=False,
+                        help='Highest p90 latency in seconds of the verification tiles for the update to pass.  '
+                             'Default: not checked')
+
+    # HTTP client settings, shared by GWC, WMS and LayerInfo requests:
+    parser.add_argument('--timeout', type=float, default=client.TIMEOUT, required=False,
+                        help='HTTP connect/read timeout in seconds.  Default: {timeout}'.format(timeout=client.TIMEOUT))
+    parser.add_argument('--retries', type=int, default=client.RETRIES, required=False,
+                        help='Maximum HTTP retries on connection errors and 5xx responses (POSTs only on connect '
+                             'errors).  Default: {retries}'.format(retries=client.RETRIES))
+    parser.add_argument('--backoff', type=float, default=client.BACKOFF, required=False,
+                        help='HTTP retry backoff factor in seconds.  Default: {backoff}'.format(backoff=client.BACKOFF))
+
+    # local state snapshots:
+    parser.add_argument('--state_dir', type=str, required=False,
+                        help='Directory to keep a snapshot of each layer\'s last applied time stops in.  While a '
+                             'snapshot is fresh, updates whose source time stops match it end after the source query, '
+                             'without reading the GWC layer.  Default: none, always read the GWC layer')
+    parser.add_argument('--state_max_age', type=float, default=state.MAX_AGE, required=False,
+                        help='Seconds after the GWC layer was last read or written that its snapshot is trusted for.  '
+                             'Default: {age}'.format(age=state.MAX_AGE))
+
+    # per-phase timing metrics:
+    parser.add_argument('--metrics_jsonl', type=str, required=False,
+                        help='JSON lines file to append per-phase update timings to')
+    parser.add_argument('--metrics_prom', type=str, required=False,
+                        help='Prometheus textfile to merge per-phase update timings into, replacing the layer\'s '
+                             'previous series')
+
     # parser.add_argument('-o', '--output', type=str, default='', required=False,
     #                    help='')
     # parser.add_argument('-o', '--output', type=str, default='', required=False,
     #
 
-    args = parser.parse_args()
+    return parser
+
+
+def main(argv=None):
+    """
+    Command line interface
+    """
+    argv = sys.argv[1:] if argv is None else argv
+
+    # 'gwc batch <config>' updates many layers from a config file in a single process:
+    if argv and argv[0] == "batch":
+        from . import batch
+        return batch.main(argv[1:])
+
+    # 'gwc watch <config>' stays resident and only updates layers whose source time stops changed:
+    if argv and argv[0] == "watch":
+        from . import watch
+        return watch.main(argv[1:])
+
+    args = build_parser().parse_args(argv)
+    configure_logging(args.log_file)
 
     filename = args.output
     try:
@@ -93,21 +245,90 @@ def main():
         print("Unable to write output file: {file}".format(file=filename))
         exit(1)
 
-    # set the output format we'll use to write date strings 'iso8601' or 'rfc3339':
-    if args.time_output_fmt == "rfc3339":
-        time_output_fmt = "%Y-%m-%dT%H:%M:%S.%fZ"
-    elif args.time_output_fmt == "iso8601":
-        time_output_fmt = "%Y-%m-%dT%H:%M:%S"
-    else:
-        time_output_fmt = "%Y-%m-%dT%H:%M:%S"
+    http_client = client.from_args(args)
+    try:
+        update_layer(args, http_client=http_client)
+    except UpdateError as e:
+        print(e)
+        exit(2)
+    finally:
+        http_client.close()
+
+
+def update_layer(args, http_client=None, timestops=None, recorder=None):
+    """
+    Run the fetch -> diff -> POST -> truncate -> seed pipeline for a single GWC layer, recording the time taken by each
+    phase to the --metrics_jsonl/--metrics_prom files
+
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param http_client: client.HTTPClient to send all requests through.  Default: the shared default client
+    :param timestops: source time stops (list of UTC epoch millisecond keys or a timeranges.TimeSet), if already queried.  Default: query the source service
+    :param recorder: metrics.Recorder to record the phases to, if the caller already recorded some (eg. the source
+        query).  Default: a new Recorder
+    :return: dict summarizing the update: layer_id, path (timeindex.UNCHANGED, DEFAULT_CHANGED or FILTER_CHANGED),
+        added, removed, default, job and task counts
+    """
+    if http_client is None:
+        http_client = client.default_client()
+    if recorder is None:
+        recorder = metrics.Recorder(args.layer_id)
+
+    error = None
+    executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS)
+    try:
+        return _update_layer(args, http_client, timestops, recorder, executor)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        executor.shutdown(wait=False)
+        recorder.finish(error)
+        metrics.export(recorder, jsonl=args.metrics_jsonl, prometheus=args.metrics_prom)
+
+
+def _update_layer(args, http_client, timestops, recorder, executor):
+    from lxml import etree
+    auth = (args.gwc_user, args.gwc_password)
+
+    # set the output format we'll use to write date strings 'iso8601' or 'rfc3339' (each time is rendered once):
+    formatter = timecodec.Formatter(args.time_output_fmt)
+
+
+    ##############################################
+    # check the local state snapshot:
+    ##############################################
+    # while the snapshot is fresh, source time stops matching it mean the GWC layer is still as the last run left it,
+    # so the source is queried first and the GWC layer isn't read at all if nothing changed:
+    snapshot = state.load(args.state_dir, args.layer_id) if args.state_dir else None
+    if state.is_fresh(snapshot, args.state_max_age):
+        if timestops is None:
+            timestops = fetch_timestops(args, http_client, recorder=recorder)
+        if timestops and timeindex.fingerprint(retained_timestops(args, timestops)) == snapshot.source:
+            print("GWC layer: {layer} is unchanged since the last run, skipping config read, update, truncate and "
+                  "seed".format(layer=args.layer_id))
+            if logger: logger.info("GWC layer: {layer} is unchanged since the last run (state snapshot: {file}), skipping config read, update, truncate and seed".format(layer=args.layer_id, file=state.path(args.state_dir, args.layer_id)))
+            return new_summary(args.layer_id, timeindex.UNCHANGED,
+                               default=formatter.format(snapshot.default) if snapshot.default is not None else None)
+
+
+    ##############################################
+    # query the NC LayerInfo Service or WMS:
+    ##############################################
+    # the source is queried and parsed on a worker thread while the GWC layer is fetched and parsed on this one, so
+    # they take as long as the slower of the two rather than both:
+    source = None
+    if timestops is None:
+        source = executor.submit(fetch_timestops, args, http_client, recorder=recorder)
 
 
     ##############################################
     # query the GWC REST API:
     ##############################################
-    url = ("/").join([args.gwc_rest_url, "layers", args.layer_id]) + ".xml"
-    if logger: logger.info("Querying GWC for layer: {layer}.  URL: {url}. Parameters {params}".format(layer=args.layer_id, url=url, params=""))
-    r = requests.get(url=url, auth=('geowebcache', 'secured'))
+    # clustered GWC nodes share one layer config, it's read from the first node that answers and the update pushed to
+    # them all:
+    nodes = gwc_rest_urls(args)
+    r, unreachable = fetch_layer_config(args, nodes, http_client, auth, recorder)
+    verified = time.time()
     #get the text output, but save 'gwc_layer_xml_byte' since etree expects bytes to avoid encoding issues
     gwc_layer_xml = r.text
     gwc_layer_xml_byte = r.content
@@ -116,397 +337,731 @@ def main():
     #out.write(gwc_layer_xml)
 
     ##############################################
-    # query the NC LayerInfo Service or WMS:
+    # lxml parsing/replacing:
     ##############################################
-    # timestops will hold the source service's time values:
-    timestops = []
+    # parse GWC XML to update with new time values:
+    # first line doesn't work, need to use byte output format from requests to generate etree for some reason
+    #parser = etree.XMLParser(encoding="UTF-8")
+    #root = etree.fromstring(gwc_layer_xml, parser)
 
-    # if a 'wms_url' parameter was passed, we'll use that:
-    if args.wms_url is not None:
-        url = args.wms_url
-        try:
-            wms = WebMapService(url, version='1.3.0')
-        except Exception as e:
-            print("WMS URL: {url} is not 1.3.0 compliant, falling back to 1.1.1.  Err: {err}".format(url=args.wms_url, err=e))
-            if logger:
-                logger.info("WMS URL: {url} is not 1.3.0 compliant, falling back to 1.1.1.  Err: {err}".format(url=args.wms_url, err=e))
-            try:
-                wms = WebMapService(url, version='1.1.1')
-            except Exception as e:
-                print("WMS URL: {url} is not 1.3.0 or 1.1.1 compliant.  Err: {err}".format(url=args.wms_url, err=e))
-                if logger:
-                    logger.info("WMS URL: {url} is not 1.3.0 or 1.1.1 compliant.  Err: {err}".format(url=args.wms_url, err=e))
-                exit(code=2)
-        print(wms.identification.type)
-        print(list(wms.contents))
+    with recorder.phase(metrics.GWC_PARSE) as phase:
+        # parse the byte output from requests instead:
+        root = etree.fromstring(gwc_layer_xml_byte)
+
+        # get the bounding box(es):
+        grid_subsets = seeding.parse_grid_subsets(root)
+
+        #time_parameter_filter = root.xpath("//parameterFilters/stringParameterFilter/key[text().lower()='time']")
+        time_parameter_filter = root.xpath("//parameterFilters/stringParameterFilter[key ='TIME']")[0]
+        time_values = time_parameter_filter.find("values")
+        time_value_default = time_parameter_filter.find("defaultValue")
+
+        # index the existing filter values by UTC epoch key (each <string> value is parsed once):
+        filter_index = timeindex.index_filter_values(time_values)
+        phase.update(timestops=len(filter_index))
+
+    # the GWC filter should be as the last run left it, unless someone else changed the layer since:
+    if snapshot is not None and (timeindex.fingerprint(filter_index) != snapshot.filter or
+                                 timeindex.default_key(time_value_default) != snapshot.default):
+        print("GWC layer: {layer} TIME filter changed since the last run".format(layer=args.layer_id))
+        if logger: logger.warning("GWC layer: {layer} TIME filter changed since the last run".format(layer=args.layer_id))
+
+    for key, grid in grid_subsets.items():
+        print("GridSet: {srs}.  Coords: {coords}".format(srs=key, coords=",".join(grid.bounds or ["full extent"])))
+
+    # timestops will hold the source service's time values (unless the caller already queried the source):
+    if source is not None:
+        timestops = source.result()
+
+    # don't empty the GWC filter list if the source didn't return anything:
+    if not timestops:
+        raise UpdateError("No time stops found in source service for GWC layer: {layer}".format(layer=args.layer_id))
+
+    with recorder.phase(metrics.DIFF) as phase:
+        # only the times within the retention window are kept in (or added to) the filter:
+        source_keys = retained_timestops(args, timestops)
+
+        # timestop_add: source timestops that will be added to the GWC layer config and used for cache seeding later
+        # gwc_time_remove: existing time parameter filters that are no longer valid, used for cache truncation later
+        reconciliation = timeindex.reconcile(source_keys, filter_index)
+        timestop_add = reconciliation.add
+        gwc_time_remove = reconciliation.remove
+
+        # default_changed: the default (no TIME parameter) cache is stale, truncate and re-seed it
+        current_default = timeindex.default_key(time_value_default)
+        change = timeindex.classify(reconciliation, current_default)
+        default_changed = reconciliation.default != current_default
+        # the exact filter values of the expired caches, GWC names parameter caches by them:
+        expired_values = dict((key, [child.text for child in filter_index.get(key, ())]) for key in gwc_time_remove)
+        phase.update(timestops=len(timestop_add) + len(gwc_time_remove))
+
+    for key in timestop_add:
+        print("New timestop from WMS added to GWC parameter filter list: {date}".format(date=formatter.format(key)))
+    for key in gwc_time_remove:
+        print("GWC time parameter filter expired: {date}".format(date=formatter.format(key)))
+
+    summary = new_summary(args.layer_id, change, added=len(timestop_add), removed=len(gwc_time_remove),
+                          default=formatter.format(reconciliation.default) if reconciliation.default is not None else None)
+
+    # nothing to do, don't make GWC reload the layer or throw away cached tiles:
+    if change == timeindex.UNCHANGED:
+        print("GWC layer: {layer} is up to date, skipping config update, truncate and seed".format(layer=args.layer_id))
+        if logger: logger.info("GWC layer: {layer} is up to date, skipping config update, truncate and seed".format(layer=args.layer_id))
+        save_state(args, source_keys, filter_index, current_default, verified)
+        return summary
+
+    # remove expired <string> elements, add new ones and set the defaultValue to be latest time:
+    timeindex.apply_reconciliation(time_values, time_value_default, filter_index, reconciliation, formatter)
+    print(len(list(time_values)))
 
-        if args.wms_layer is not None:
-            if args.wms_layer in wms.contents:
-                print("OWSLib timepositions:")
-                for timeposition in wms.contents[args.wms_layer].timepositions:
-                    print(timeposition)
-                    # timestops.append(datetime.strptime(timeposition, "%Y-%m-%dT%H:%M:%S.%f%z"))
-                    timestops.append(dateutil.parser.parse(timeposition))
-                    #timestops.append(pendulum.parse(timeposition))
+    print("final_valid_times:")
+    for key in sorted(reconciliation.remain + timestop_add, reverse=True):
+        print(formatter.format(key))
 
-    # otherwise, use the LayerInfo Servlet to query for new time stops:
+
+    # debug: print the resulting XML to stdout for debug:
+    #print(etree.dump(root, pretty_print=True))
+
+
+    ##############################################
+    #submit new layer config to GWC, then seed and truncate:
+    ##############################################
+    # GWC only takes whole layer configs, so this is the config as fetched with just the TIME filter modified:
+    data = etree.tostring(root, encoding="UTF-8")
+
+    # plan jobs for every expired/new timestop across every gridset (or those selected with --gridsets):
+    try:
+        gridsets = [name.strip() for name in args.gridsets.split(",")] if args.gridsets else None
+        planner = seeding.Planner(grid_subsets, gridsets=gridsets,
+                                  seed_zoom=args.seed_zoom, truncate_zoom=args.truncate_zoom,
+                                  gridset_zooms=seeding.parse_gridset_zooms(args.gridset_zoom))
+        tile_budget = seed_tile_budget(args)
+    except ValueError as e:
+        raise UpdateError("Invalid seed configuration for GWC layer: {layer}.  Err: {err}".format(layer=args.layer_id, err=e))
+
+    # one deadline for this run's tasks on every node:
+    deadline = time.time() + args.seed_timeout if args.seed_timeout else None
+    push = lambda node: update_node(args, node, data, change, planner, reconciliation, expired_values, default_changed,
+                                    formatter, http_client, auth, recorder, deadline, executor,
+                                    tile_budget=tile_budget, label=node if len(nodes) > 1 else None)
+
+    if len(nodes) == 1:
+        results = [push(nodes[0])]
+    else:
+        # every node runs its own pipeline concurrently, job POSTs share the (now idle) pipeline executor.  Nodes the
+        # layer config couldn't be read from are reported as failed without pushing to them:
+        by_node = dict((result['url'], result) for result in unreachable)
+        targets = [node for node in nodes if node not in by_node]
+        with ThreadPoolExecutor(max_workers=len(targets)) as node_executor:
+            by_node.update(zip(targets, node_executor.map(lambda node: _update_node_result(push, node), targets)))
+        results = [by_node[node] for node in nodes]
+        report_nodes(args.layer_id, results)
+        failed = [result for result in results if result['error']]
+        if failed:
+            raise UpdateError("Update of GWC layer: {layer} failed on {failed} of {total} GWC nodes: {nodes}".format(
+                layer=args.layer_id, failed=len(failed), total=len(nodes),
+                nodes=", ".join(result['url'] for result in failed)))
+
+    save_state(args, source_keys, reconciliation.remain + timestop_add, reconciliation.default, time.time())
+
+    summary.update({
+        'truncated': max(result['truncated'] for result in results),
+        'seeded': max(result['seeded'] for result in results),
+        'tasks': sum(result['tasks'] for result in results),
+    })
+    if len(nodes) > 1:
+        summary['nodes'] = results
     else:
-        url = args.nc_layerinfo_url
-        payload = {'request': 'timestops', 'service': args.nc_service, 'layers': args.nc_layers, 'format': args.nc_fmt}
-        if logger: logger.info("Querying NC LayerInfo service: {url}. Parameters: {params}".format(layer=args.layer_id, url=url, params=payload))
+        summary['verify'] = results[0]['verify']
+    return summary
 
-        r = requests.get(url=url, params=payload)
-        layerinfo_result = r.text
 
-        # convert to json to extract timestops
-        nc_layerinfo_json = json.loads(layerinfo_result)
-        timestops = nc_layerinfo_json['layers'][0]['timeStops']
-        # debug:
-        #print(json.dumps(nc_layerinfo_json, indent=4))
-        #out.write(json.dumps(nc_layerinfo_json, indent=4) + "\n")
+def update_node(args, rest_url, data, change, planner, reconciliation, expired_values, default_changed, formatter,
+                http_client, auth, recorder, deadline, executor, tile_budget=None, label=None):
+    """
+    Push an updated layer config to a GWC node, then truncate its expired caches and seed the new times
+
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param rest_url: GWC REST API URL of the node
+    :param data: updated layer config XML (bytes)
+    :param change: what changed, timeindex.DEFAULT_CHANGED or FILTER_CHANGED
+    :param planner: seeding.Planner for the layer
+    :param reconciliation: the timeindex.Reconciliation applied to the config
+    :param expired_values: dict of expired epoch key -> list of its TIME filter value strings
+    :param default_changed: True if the default (no TIME parameter) cache has to be truncated and re-seeded
+    :param formatter: timecodec.Formatter to write TIME parameters with
+    :param http_client: client.HTTPClient to send requests through
+    :param auth: GWC REST API (user, password)
+    :param recorder: metrics.Recorder to record the phases to
+    :param deadline: time.time() value to kill this run's tasks at.  Default: no deadline
+    :param executor: concurrent.futures executor to POST seed/truncate jobs on concurrently
+    :param tile_budget: most tiles to seed, see seed_tile_budget().  Default: no budget
+    :param label: node label of the recorded phases, when updating more than one node.  Default: none
+    :return: dict of the node's 'url' and truncate/seed job and task counts
+    :raises UpdateError: if the run's tasks didn't finish by the deadline, since the new times are already in the
+        config and a later run wouldn't seed them
+    """
+    timestop_add = reconciliation.add
+    gwc_time_remove = reconciliation.remove
 
-        for i, stop in enumerate(timestops):
-            timestops[i] = datetime.utcfromtimestamp(stop / 1000)
+    url = ("/").join([rest_url, "layers", args.layer_id]) + ".xml"
+    print("Updating GWC layer: {layer} ({change} changed)".format(layer=args.layer_id, change=change))
+    if logger: logger.info(
+        "Updating GWC layer: {layer} via POST ({change} changed).  URL: {url}.".format(layer=args.layer_id, change=change, url=url))
+    with recorder.phase(metrics.CONFIG_POST, node=label) as phase:
+        r = rest_request(http_client, "post", url, auth=auth, data=data, headers={'Content-Type': 'text/xml'})
+        phase.update(status=r.status_code, bytes=len(data),
+                     timestops=len(reconciliation.remain) + len(timestop_add))
 
 
     ##############################################
-    # lxml parsing/replacing:
+    # seed and truncate:
     ##############################################
-    # parse GWC XML to update with new time values:
-    # first line doesn't work, need to use byte output format from requests to generate etree for some reason
-    #parser = etree.XMLParser(encoding="UTF-8")
-    #root = etree.fromstring(gwc_layer_xml, parser)
+    url = ("/").join([rest_url, "seed", args.layer_id]) + ".json"
+
+    # track the tasks this run submits (not every task on the layer), within an optional deadline:
+    task_monitor = seed_monitor(args, http_client, auth, rest_url=rest_url)
+    task_monitor.snapshot()
+
+    ##############################################
+    # truncating:
+    ##############################################
+    # drop the expired time parameter filter caches in bulk (now that the config no longer allows them), leaving
+    # whatever GWC won't mass truncate to truncate seed tasks:
+    expired = gwc_time_remove
+    if expired and args.truncate_mode != seeding.TRUNCATE_SEED:
+        with recorder.phase(metrics.MASS_TRUNCATE, node=label) as phase:
+            expired = mass_truncate(args, http_client, auth, expired_values, rest_url=rest_url)
+            phase.update(timestops=len(gwc_time_remove) - len(expired))
+
+    # truncate the default cache if the default time moved (it has to be re-seeded) and any remaining expired caches:
+    # truncating by the filter's own value strings, which may not be in the current --time_output_fmt:
+    truncate_jobs = planner.plan(seeding.TRUNCATE, expired, default_cache=default_changed, time_values=expired_values)
+    with recorder.phase(metrics.TRUNCATE_SUBMIT, node=label) as phase:
+        skipped = submit_jobs(truncate_jobs, args, url, formatter, args.truncate_thread_count, http_client, auth,
+                              task_monitor, deadline=deadline, executor=executor)
+        phase.update(timestops=len(gwc_time_remove))
+
+    # wait until we know truncate has completed before starting seeding
+    # (mostly due to 'default' time cache needing to be re-seeded on each update - cache must be fully truncated first):
+    with recorder.phase(metrics.TRUNCATE_WAIT, node=label):
+        completed = not skipped and task_monitor.wait(deadline=deadline)
+
+    ##############################################
+    # seeding:
+    ##############################################
+    # first, we want to seed the default cache (no time filter value) if the default time moved:
+    # default cache appears to exist even if <defaultValue> is set to most recent time filter value and a time filter
+    # cache exists for this time value
+    # next, we want to seed every newly added timestop in its own time filter cache, newest first:
+    seed_jobs = planner.plan(seeding.SEED, timestop_add, default_cache=default_changed)
+    seed_jobs = budget_seed_jobs(args, seed_jobs, tile_budget)
+    if completed:
+        with recorder.phase(metrics.SEED_SUBMIT, node=label) as phase:
+            skipped = submit_jobs(seed_jobs, args, url, formatter, args.seed_thread_count, http_client, auth,
+                                  task_monitor, deadline=deadline, executor=executor,
+                                  controller=task_monitor.controller)
+            phase.update(timestops=len(timestop_add))
+        # just check the seeding status to know if it's completed
+        with recorder.phase(metrics.SEED_WAIT, node=label):
+            completed = not skipped and task_monitor.wait(deadline=deadline)
+    else:
+        skipped += seed_jobs
+
+    # kill whatever this run left running past the deadline, the update didn't complete:
+    if not completed:
+        killed = task_monitor.kill_running()
+        print("Seed deadline of {timeout}s exceeded for GWC layer: {layer}.  Killed {killed} tasks, skipped {skipped} jobs".format(
+            timeout=args.seed_timeout, layer=args.layer_id, killed=len(killed), skipped=len(skipped)))
+        if logger: logger.warning("Seed deadline of {timeout}s exceeded for GWC layer: {layer}.  URL: {url}.  Killed tasks: {killed}, skipped {skipped} jobs".format(
+            timeout=args.seed_timeout, layer=args.layer_id, url=rest_url, killed=killed, skipped=len(skipped)))
+        raise UpdateError("Seed deadline of {timeout}s exceeded for GWC layer: {layer}: killed {killed} tasks, skipped "
+                          "{skipped} jobs.  Their caches aren't seeded".format(
+                              timeout=args.seed_timeout, layer=args.layer_id, killed=len(killed), skipped=len(skipped)))
+
+    result = {
+        'url': rest_url,
+        'truncated': len(truncate_jobs),
+        'seeded': len(seed_jobs),
+        'tasks': len(task_monitor.tracked),
+        'verify': None,
+    }
+
+    ##############################################
+    # verify the seeded caches:
+    ##############################################
+    if args.verify_samples > 0 and seed_jobs:
+        with recorder.phase(metrics.VERIFY, node=label) as phase:
+            result['verify'] = verify_cache(args, rest_url, seed_jobs, formatter, http_client)
+            phase.update(timestops=len(set(job.time_key for job in seed_jobs)))
+    return result
+
+
+def verify_cache(args, rest_url, jobs, formatter, http_client):
+    """
+    Request a random sample of the seeded tiles of each TIME value and check the cache hit ratio and latency
+
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param rest_url: GWC REST API URL of the node that seeded the tiles
+    :param jobs: list of the seeding.SeedJob submitted
+    :param formatter: timecodec.Formatter to write TIME parameters with
+    :param http_client: client.HTTPClient to send requests through
+    :return: the verify.summarize() report, with 'passed'
+    :raises UpdateError: if the sample fails the --verify_min_hit_ratio/--verify_max_latency thresholds
+    """
+    url = args.verify_url or (rest_url[:-len("/rest")] if rest_url.endswith("/rest") else rest_url) + "/service/wmts"
+    tiles = verify.sample_tiles(jobs, samples=args.verify_samples)
+    if logger: logger.info("Verifying {count} seeded tiles of GWC layer: {layer}.  URL: {url}.".format(
+        count=len(tiles), layer=args.layer_id, url=url))
+    results = verify.fetch_tiles(http_client, url, tiles, args.layer_id, formatter, tile_format=args.tile_format,
+                                 workers=args.verify_workers)
+    report = verify.summarize(results)
+    failures = verify.check(report, min_hit_ratio=args.verify_min_hit_ratio, max_latency=args.verify_max_latency)
+    report['passed'] = not failures
+
+    latency = lambda value: "{0:.3f}s".format(value) if value is not None else "-"
+    print("Verified {samples} tiles of GWC layer: {layer}: {hits} hits, {misses} misses, {errors} errors, hit ratio: "
+          "{ratio}, latency p50: {p50}, p90: {p90}, p99: {p99}".format(
+              layer=args.layer_id, samples=report['samples'], hits=report['hits'], misses=report['misses'],
+              errors=report['errors'], ratio="{0:.2f}".format(report['hit_ratio']) if report['samples'] else "-",
+              p50=latency(report['p50']), p90=latency(report['p90']), p99=latency(report['p99'])))
+    if failures:
+        if logger: logger.error("Cache verification failed for GWC layer: {layer}.  URL: {url}.  {failures}".format(
+            layer=args.layer_id, url=url, failures=", ".join(failures)))
+        raise UpdateError("Cache verification failed for GWC layer: {layer}: {failures}".format(
+            layer=args.layer_id, failures=", ".join(failures)))
+    return report
+
+
+def seed_tile_budget(args):
+    """
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :return: most tiles to seed per update from --seed_tile_budget and --seed_time_budget, or None for no budget
+    :raises ValueError: if a budget isn't positive, or --seed_time_budget is set without --seed_rate
+    """
+    budgets = []
+    if args.seed_tile_budget is not None:
+        budgets.append(args.seed_tile_budget)
+    if args.seed_time_budget is not None:
+        if not args.seed_rate:
+            raise ValueError("seed_time_budget needs the expected seeding throughput, seed_rate")
+        budgets.append(int(args.seed_time_budget * args.seed_rate))
+    if any(budget <= 0 for budget in budgets):
+        raise ValueError("Seed budgets must be positive")
+    return min(budgets) if budgets else None
+
+
+def budget_seed_jobs(args, seed_jobs, tile_budget):
+    """
+    Estimate the tiles of an update's seed jobs and cut them back to the deepest zoom level that fits the tile budget
 
-    # parse the byte output from requests instead:
-    root = etree.fromstring(gwc_layer_xml_byte)
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param seed_jobs: list of seeding.SeedJob
+    :param tile_budget: most tiles to seed, or None for no budget
+    :return: list of seeding.SeedJob to submit
+    """
+    if not seed_jobs:
+        return seed_jobs
+    if tile_budget is None:
+        tiles = [seeding.job_tiles(job) for job in seed_jobs]
+        print("Seed jobs for GWC layer: {layer}: {jobs}, estimated tiles: {tiles}".format(
+            layer=args.layer_id, jobs=len(seed_jobs),
+            tiles=sum(tiles) if None not in tiles else "unknown"))
+        return seed_jobs
+
+    fitted, tiles, zoom_stop = seeding.fit_budget(seed_jobs, tile_budget)
+    print("Seed jobs for GWC layer: {layer}: {jobs}, estimated tiles: {tiles} of a {budget} tile budget{cut}".format(
+        layer=args.layer_id, jobs=len(fitted), tiles=tiles, budget=tile_budget,
+        cut=", cut back to zoom level {zoom}".format(zoom=zoom_stop) if zoom_stop is not None else ""))
+    if zoom_stop is not None:
+        if logger: logger.info("Seed jobs for GWC layer: {layer} cut back to zoom level {zoom} to fit a {budget} tile budget ({tiles} tiles)".format(
+            layer=args.layer_id, zoom=zoom_stop, budget=tile_budget, tiles=tiles))
+    if tiles > tile_budget:
+        if logger: logger.warning("Seed jobs for GWC layer: {layer} exceed the {budget} tile budget even at their shallowest zoom level ({tiles} tiles)".format(
+            layer=args.layer_id, budget=tile_budget, tiles=tiles))
+    return fitted
+
+
+def fetch_layer_config(args, nodes, http_client, auth, recorder):
+    """
+    Read the layer config from the first GWC node that answers
+
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param nodes: list of GWC REST API URLs, see gwc_rest_urls()
+    :param http_client: client.HTTPClient to send requests through
+    :param auth: GWC REST API (user, password)
+    :param recorder: metrics.Recorder to record the GWC_GET phase of each node tried to
+    :return: tuple of (the requests response, list of failed per-node result dicts of the nodes tried before it)
+    :raises UpdateError: if no node answered
+    """
+    unreachable = []
+    for node in nodes:
+        url = ("/").join([node, "layers", args.layer_id]) + ".xml"
+        if logger: logger.info("Querying GWC for layer: {layer}.  URL: {url}. Parameters {params}".format(layer=args.layer_id, url=url, params=""))
+        result, start = _node_result(node), time.time()
+        try:
+            with recorder.phase(metrics.GWC_GET, node=node if len(nodes) > 1 else None) as phase:
+                r = rest_request(http_client, "get", url, auth=auth)
+                phase.update(status=r.status_code, bytes=len(r.content))
+            return r, unreachable
+        except UpdateError as e:
+            if node == nodes[-1]:
+                raise
+            print("Unable to read GWC layer: {layer} from GWC node: {url}, trying the next node".format(
+                layer=args.layer_id, url=node))
+            result.update(error="{type}: {err}".format(type=type(e).__name__, err=e), elapsed=time.time() - start)
+            unreachable.append(result)
+
+
+def _node_result(node):
+    return {'url': node, 'error': None, 'truncated': 0, 'seeded': 0, 'tasks': 0, 'verify': None}
+
+
+def _update_node_result(push, node):
+    # a failed node is reported alongside the others rather than abandoning them:
+    start = time.time()
+    result = _node_result(node)
+    try:
+        result.update(push(node))
+    except Exception as e:
+        if isinstance(e, UpdateError):
+            logger.error("Update failed on GWC node: {url}.  Err: {err}".format(url=node, err=e))
+        else:
+            logger.exception("Update failed on GWC node: {url}".format(url=node))
+        result['error'] = "{type}: {err}".format(type=type(e).__name__, err=e)
+    result['elapsed'] = time.time() - start
+    return result
+
+
+def report_nodes(layer_id, results):
+    """
+    Print the outcome of a layer update on each GWC node
 
-    # get the bounding box(es):
-    grid_subsets = {}
-    layer_grid_subsets = root.xpath("//gridSubsets/gridSubset")
-    for grid in layer_grid_subsets:
-        #coords = grid.xpath("extent/coords")
-        coords = grid.find("extent/coords")
-        grid_subsets[grid.find("gridSetName").text] = [bound.text for bound in coords.iter("double")]
+    :param layer_id: GWC layer ID
+    :param results: list of per-node result dicts, each with 'url', 'elapsed', 'error' and job/task counts
+    """
+    for result in results:
+        if result['error']:
+            print("GWC node: {url}: {layer} FAILED in {elapsed:.1f}s.  Err: {err}".format(
+                url=result['url'], layer=layer_id, elapsed=result['elapsed'], err=result['error']))
+        else:
+            print("GWC node: {url}: {layer} updated in {elapsed:.1f}s.  truncate jobs: {truncated}, seed jobs: "
+                  "{seeded}, tasks: {tasks}".format(layer=layer_id, **result))
 
-    for key, coords in grid_subsets.items():
-        print("GridSet: {srs}.  Coords: {coords}".format(srs=key, coords=",".join(coords)))
 
+def gwc_rest_urls(args):
+    """
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :return: list of the GWC REST API URLs to update, from a comma separated string (or list, in batch configs)
+    """
+    urls = args.gwc_rest_url
+    if not isinstance(urls, (list, tuple)):
+        urls = urls.split(",")
+    urls = [url.strip() for url in urls if url.strip()]
+    if not urls:
+        raise UpdateError("No GWC REST API URL given for GWC layer: {layer}".format(layer=args.layer_id))
+    return urls
 
-    #time_parameter_filter = root.xpath("//parameterFilters/stringParameterFilter/key[text().lower()='time']")
-    time_parameter_filter = root.xpath("//parameterFilters/stringParameterFilter[key ='TIME']")[0]
-    time_values = time_parameter_filter.find("values")
-    time_value_default = time_parameter_filter.find("defaultValue")
 
-    gwc_filter_times = []
-    for child in time_values.iter("string"):
-        #print(child.text)
+def new_summary(layer_id, change, added=0, removed=0, default=None):
+    """
+    :return: dict summarizing a layer update, see update_layer(), before any truncate/seed jobs ran
+    """
+    return {
+        'layer_id': layer_id,
+        'path': change,
+        'added': added,
+        'removed': removed,
+        'default': default,
+        'truncated': 0,
+        'seeded': 0,
+        'tasks': 0,
+        'verify': None,
+    }
 
-        # use with date formats like: 2017-09-06T13:00:00.000Z
-        #gwc_filter_times.append(datetime.strptime(child.text.replace('Z', '+0000'), "%Y-%m-%dT%H:%M:%S.%f%z"))
-        # use with date formats like: 2017-09-12T11:44:00
-        #gwc_filter_times.append(datetime.strptime(child.text, "%Y-%m-%dT%H:%M:%S"))
 
-        # Try dateutil parser for more universal support... (2017-09-06T13:00:00.000Z, 2017-09-12T11:44:00)
-        gwc_filter_times.append(dateutil.parser.parse(child.text))
+def retained_timestops(args, timestops):
+    """
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param timestops: source time stops (list of epoch keys or a timeranges.TimeSet)
+    :return: timeranges.TimeSet of the time stops within the --retain_count/--retain_age window
+    :raises UpdateError: if the retention options are invalid
+    """
+    try:
+        return timeindex.retain(timestops, max_count=args.retain_count, max_age=args.retain_age)
+    except ValueError as e:
+        raise UpdateError("Invalid retention window for GWC layer: {layer}.  Err: {err}".format(layer=args.layer_id, err=e))
 
-    # debug: print gwc_filter_times:
-    #print(gwc_filter_times)
 
-    # timestop_add: list of NC timestops that will be added to the GWC layer config and used for cache seeding later
-    timestop_add = []
-    for timestop in timestops:
-        if timestop not in gwc_filter_times:
+def save_state(args, timestops, filter_keys, default, verified):
+    """
+    Snapshot the state an update left the GWC layer in, if --state_dir is set
 
-            print("New timestop from WMS added to GWC parameter filter list: {date}".format(date=timestop.strftime(time_output_fmt)))
-            timestop_add.append(timestop)
+    :param args: the layer's options
+    :param timestops: source time stops applied to the layer, within the retention window
+    :param filter_keys: epoch keys of the GWC TIME filter values after the update
+    :param default: epoch key of the GWC TIME filter <defaultValue> after the update
+    :param verified: time.time() the GWC layer was read or written
+    """
+    if args.state_dir:
+        state.save(args.state_dir, state.Snapshot(args.layer_id, timeindex.fingerprint(timestops),
+                                                  timeindex.fingerprint(filter_keys), default, verified))
 
-            #add new 'string' subelements:
-            time_values.append(etree.fromstring("<string>{date}</string>".format(date=timestop.strftime(time_output_fmt))))
-            print(len(list(time_values)))
 
-    # gwc_time_remove: list of existing time parameter filters that are no longer valid, used for cache truncation later
-    # gwc_time_remain: just a copy of the gwc_filter_times list to keep a list of still valid gwc_filter_times (to calc defaultValue)
-    gwc_time_remove = []
-    gwc_time_remain = list(gwc_filter_times)
-    for gwc_filter_time in gwc_filter_times:
-        if gwc_filter_time not in timestops:
-            print("GWC time parameter filter expired: {date}".format(date=gwc_filter_time.strftime(time_output_fmt)))
-            gwc_time_remove.append(gwc_filter_time)
+def seed_monitor(args, http_client, auth, rest_url=None):
+    """
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param http_client: client.HTTPClient to send requests through
+    :param auth: GWC REST API (user, password)
+    :param rest_url: GWC REST API URL of the node running the tasks.  Default: the first of args.gwc_rest_url
+    :return: a monitor.SeedMonitor for the layer's GWC seed tasks
+    """
+    url = ("/").join([rest_url or gwc_rest_urls(args)[0], "seed", args.layer_id])
 
-            # remove the expired time from the gwc_time_remain list also (need current list to calculate defaultValue):
-            gwc_time_remain.remove(gwc_filter_time)
+    def get_status():
+        # response should look like:
+        #   running task: {"long-array-array":[[-1,-1,-2,314,2]]}
+        #   no tasks: {"long-array-array":[]}
+        return rest_request(http_client, "get", url + ".json", auth=auth).json()
 
-            # iterate over the <string> XML config elements to identify those to remove:
-            for child in time_values.iter("string"):
-                if dateutil.parser.parse(child.text) == gwc_filter_time:
-                    #print("Match: " + child.text)
-                    time_values.remove(child)
+    def kill_task(task_id):
+        rest_request(http_client, "post", url, auth=auth, data={'kill_thread': '1', 'thread_id': str(task_id)})
 
-            print(len(list(time_values)))
+    controller = None
+    if args.seed_adaptive:
+        controller = monitor.ThreadController(args.seed_thread_count, max_threads=max(1, args.seed_thread_budget),
+                                              max_latency=args.seed_max_latency)
+    return monitor.SeedMonitor(get_status, kill_task, max_interval=args.seed_poll_max, controller=controller)
 
-    # set the defaultValue to be latest time:
-    final_valid_times = gwc_time_remain + timestop_add
-    final_valid_times.sort(reverse=True)
-    time_value_default.text = final_valid_times[0].strftime(time_output_fmt)
 
-    print("final_valid_times:")
-    for time_value in final_valid_times:
-        print(time_value.strftime(time_output_fmt))
+def mass_truncate(args, http_client, auth, expired_values, rest_url=None):
+    """
+    Drop expired time parameter caches through the GWC masstruncate REST API, starting with args.truncate_mode and
+    falling back to the next mode if GWC rejects a request
+
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param http_client: client.HTTPClient to send requests through
+    :param auth: GWC REST API (user, password)
+    :param expired_values: dict of expired epoch key -> list of its TIME filter value strings
+    :param rest_url: GWC REST API URL of the node to truncate on.  Default: the first of args.gwc_rest_url
+    :return: sorted list of the expired keys that still need truncate seed tasks
+    """
+    url = ("/").join([rest_url or gwc_rest_urls(args)[0], "masstruncate"])
+    headers = {'Content-Type': 'text/xml'}
+    remaining = sorted(expired_values)
+    modes = seeding.TRUNCATE_MODES[seeding.TRUNCATE_MODES.index(args.truncate_mode):]
 
+    for mode in modes:
+        try:
+            if mode == seeding.TRUNCATE_ORPHANS:
+                rest_request(http_client, "post", url, auth=auth, headers=headers,
+                             data=seeding.truncate_orphans_request(args.layer_id))
+                remaining = []
+            elif mode == seeding.TRUNCATE_PARAMETERS:
+                while remaining:
+                    for value in expired_values[remaining[0]]:
+                        rest_request(http_client, "post", url, auth=auth, headers=headers,
+                                     data=seeding.truncate_parameters_request(args.layer_id, value))
+                    remaining.pop(0)
+            else:
+                break
+        except UpdateError as e:
+            print("GWC mass truncate ({mode}) failed for layer: {layer}, falling back.  Err: {err}".format(
+                mode=mode, layer=args.layer_id, err=e))
+            if logger: logger.warning("GWC mass truncate ({mode}) failed for layer: {layer}, falling back.  Err: {err}".format(
+                mode=mode, layer=args.layer_id, err=e))
+            continue
+        print("Truncated {count} expired time caches of GWC layer: {layer} via masstruncate ({mode})".format(
+            count=len(expired_values), layer=args.layer_id, mode=mode))
+        if logger: logger.info("Truncated {count} expired time caches of GWC layer: {layer} via masstruncate ({mode})".format(
+            count=len(expired_values), layer=args.layer_id, mode=mode))
+        break
+
+    return remaining
+
+
+def submit_jobs(jobs, args, url, formatter, thread_count, http_client, auth, task_monitor, deadline=None,
+                executor=None, controller=None):
+    """
+    Submit seed/truncate jobs in order, keeping the layer's running GWC tasks (one per seeding thread) within the
+    thread budget.  Whenever there's capacity for more threads, the jobs that fit are all POSTed at once
+
+    :param jobs: list of seeding.SeedJob, in submission order
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param url: GWC REST API seed URL for the layer
+    :param formatter: timecodec.Formatter to write TIME parameters with
+    :param thread_count: number of GWC threads to run each job with
+    :param http_client: client.HTTPClient to send requests through
+    :param auth: GWC REST API (user, password)
+    :param task_monitor: monitor.SeedMonitor tracking the tasks of this run
+    :param deadline: time.time() value to stop submitting at.  Default: no deadline
+    :param executor: concurrent.futures executor to POST the jobs that fit on concurrently.  Default: one at a time
+    :param controller: monitor.ThreadController to take each job's thread count from, instead of thread_count.
+        Default: none
+    :return: list of the jobs not submitted before the deadline
+    """
+    budget = max(1, args.seed_thread_budget)
+    pending = deque(jobs)
+    post = lambda data: rest_seed_truncate(url, "post", data, http_client=http_client, auth=auth)
+    while pending:
+        if controller is not None:
+            thread_count = controller.thread_count
+        # wait for room for another job's threads (a job larger than the budget waits for every task to finish):
+        if not task_monitor.wait(deadline=deadline, max_tasks=max(1, budget - thread_count + 1)):
+            break
+        payloads = []
+        for _ in range(max(1, (budget - len(task_monitor.tasks)) // max(1, thread_count))):
+            if not pending:
+                break
+            job = pending.popleft()
+            data = seeding.seed_request(job, args.layer_id, formatter, thread_count, tile_format=args.tile_format)
+            print("Seed request json for {job}:".format(job=seeding.describe(job, formatter)))
+            print(data)
+            if logger: logger.info("Submitting GWC {job} for layer: {layer}.  URL: {url}.".format(
+                job=seeding.describe(job, formatter), layer=args.layer_id, url=url))
+            payloads.append(data)
+        # list() waits for every POST, raising the first error:
+        list(executor.map(post, payloads) if executor is not None else map(post, payloads))
+        task_monitor.claim()
+    return list(pending)
 
-    # debug: print the resulting XML to stdout for debug:
-    #print(etree.dump(root, pretty_print=True))
 
+def fetch_timestops(args, http_client, recorder=None):
+    """
+    Query the source service (WMS if 'wms_url' is set, otherwise the NC LayerInfo Servlet) for the layer's time stops
 
-    ##############################################
-    #submit new layer config to GWC:
-    ##############################################
-    url = ("/").join([args.gwc_rest_url, "layers", args.layer_id]) + ".xml"
-    if logger: logger.info(
-        "Updating GWC layer: {layer} via POST.  URL: {url}.".format(layer=args.layer_id, url=url))
-    r = requests.post(url=url, auth=('geowebcache', 'secured'), data=etree.tostring(root))
+    :param args: argparse.Namespace (or equivalent) holding the layer's options, see build_parser()
+    :param http_client: client.HTTPClient to send requests through
+    :param recorder: metrics.Recorder to record the source query and parse phases to.  Default: not recorded
+    :return: time stops (UTC epoch millisecond keys): a list, or a timeranges.TimeSet for WMS sources
+    """
+    if recorder is None:
+        recorder = metrics.Recorder(args.layer_id)
+    timestops = []
 
+    # if a 'wms_url' parameter was passed, we'll use that:
+    if args.wms_url is not None:
+        if args.wms_layer is not None:
+            if logger: logger.info("Querying WMS capabilities: {url}. Layer: {layer}".format(url=args.wms_url, layer=args.wms_layer))
+            # the capabilities document is parsed as it streams in, so this phase includes the XML parse:
+            with recorder.phase(metrics.SOURCE_QUERY) as phase:
+                try:
+                    timepositions = capabilities.get_time_positions(http_client, args.wms_url, args.wms_layer,
+                                                                    scope=args.wms_scope, stats=phase)
+                except (capabilities.CapabilitiesError, requests.exceptions.RequestException) as e:
+                    if logger: logger.error("WMS capabilities request failed: {url}.  Err: {err}".format(url=args.wms_url, err=e))
+                    raise UpdateError("WMS capabilities request failed: {url}.  Err: {err}".format(url=args.wms_url, err=e))
+                phase.update(timestops=len(timepositions))
+
+            print("WMS timepositions:")
+            for timeposition in timepositions:
+                print(timeposition)
+            # keep 'start/end/period' intervals as unexpanded ranges:
+            with recorder.phase(metrics.SOURCE_PARSE) as phase:
+                timestops = timeranges.parse_positions(timepositions)
+                phase.update(timestops=timestops.size())
 
+    # otherwise, use the LayerInfo Servlet to query for new time stops:
+    else:
+        with recorder.phase(metrics.SOURCE_QUERY) as phase:
+            r = query_layerinfo(args, http_client)
+            phase.update(status=r.status_code, bytes=len(r.content))
+        with recorder.phase(metrics.SOURCE_PARSE) as phase:
+            timestops = parse_layerinfo(r, nc_layer=nc_layer(args))
+            phase.update(timestops=len(timestops))
 
-    ##############################################
-    # seed and truncate:
-    ##############################################
+    return timestops
 
-    '''
-    # from docs:
-    {
-        "seedRequest": {
-            "name": "topp:states",
-            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
-            "srs": {"number": 4326},
-            "zoomStart": 1,
-            "zoomStop": 12,
-            "format": "image\/png",
-            "type": "seed",
-            "threadCount": 4
-        }
-    }
-    
-    { "seedRequest": {
-            "name": "topp:states",
-            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
-            "srs": {"number":4326},
-            "zoomStart": 1,
-            "zoomStop": 12,
-            "format": "image\/png",
-            "type": "truncate",
-            "threadCount": 4
-        }
-    }
-    '''
-
-    truncate_template_time = {
-        "seedRequest": {
-            "name":"topp:states",
-            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
-            "srs": {"number": 4326},
-            "zoomStart": 0,
-            "zoomStop": 20,
-            "format": "image/png",
-            "type": "truncate",
-            "threadCount": 1,
-            "parameters": {
-                "entry": [
-                    {"string": ["TIME", "2017-09-13T12:56:00"]}
-                ]
-            }
-
-        }
-    }
 
-    truncate_template = {
-        "seedRequest": {
-            "name": "topp:states",
-            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
-            "srs": {"number": 4326},
-            "zoomStart": 0,
-            "zoomStop": 20,
-            "format": "image/png",
-            "type": "truncate",
-            "threadCount": 1
-        }
-    }
+def nc_layer(args):
+    """
+    :param args: argparse.Namespace (or equivalent) holding the layer's 'nc_*' options, see build_parser()
+    :return: id of the nowCOAST layer whose time stops are applied to the GWC layer (the first of --nc_layers), or
+        None if no layers are set
+    """
+    if not args.nc_layers:
+        return None
+    return args.nc_layers.split(",")[0].strip()
 
-    seed_template_bbox = {
-        "seedRequest": {
-            "name": "topp:states",
-            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
-            "srs": {"number": 4326},
-            "zoomStart": 0,
-            "zoomStop": 7,
-            "format": "image/png",
-            "type": "seed",
-            "threadCount": 4
-        }
-    }
 
-    seed_template_bbox_time = {
-        "seedRequest": {
-            "name": "topp:states",
-            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
-            "srs": {"number": 4326},
-            "zoomStart": 0,
-            "zoomStop": 7,
-            "format": "image/png",
-            "type": "seed",
-            "threadCount": 4,
-            "parameters": {
-                "entry": [
-                    {"string": ["TIME", "2017-09-13T12:56:00"]}
-                ]
-            }
-        }
-    }
+def query_layerinfo(args, http_client, headers=None):
+    """
+    :param args: argparse.Namespace (or equivalent) holding the layer's 'nc_*' options, see build_parser()
+    :param http_client: client.HTTPClient to send the request through
+    :param headers: optional extra request headers (eg. conditional request headers)
+    :return: the requests response object
+    """
+    url = args.nc_layerinfo_url
+    payload = {'request': 'timestops', 'service': args.nc_service, 'layers': args.nc_layers, 'format': args.nc_fmt}
+    if logger: logger.info("Querying NC LayerInfo service: {url}. Parameters: {params}".format(layer=args.layer_id, url=url, params=payload))
 
-    seed_template = {
-        "seedRequest": {
-            "name": "topp:states",
-            "srs": {"number": 4326},
-            "zoomStart": 1,
-            "zoomStop": 7,
-            "format": "image/png",
-            "type": "seed",
-            "threadCount": 4
-        }
-    }
+    return rest_request(http_client, "get", url, params=payload, headers=headers)
 
-    url = ("/").join([args.gwc_rest_url, "seed", args.layer_id]) + ".json"
 
-    ##############################################
-    # truncating:
-    ##############################################
-    # ToDo: this will all need to be wrapped in a function or iterated over by:
-    #   gridset SRS (only handles 4326 currently)
-    # ToDo: need to account for zoomLevel (presently only hard-coded to 1 to 7 in JSON templates (should truncate all levels)
-
-    # TEST: test truncating default cache:
-    data = truncate_template
-    data['seedRequest']['name'] = args.layer_id
-    data['seedRequest']['srs']['number'] = 4326
-    data['seedRequest']['bounds']['coords']['double'] = grid_subsets['EPSG:4326']
-    print("Truncate request (default cache) json:")
-    print(data)
-    if logger: logger.info(
-        "Truncating GWC default cache for layer: {layer}. URL: {url}.".format(layer=args.layer_id, url=url))
-    rest_seed_truncate(url, "post", data)
-
-    # truncate expired time parameter filter caches:
-    #print(gwc_time_remove)
-    if True:
-        for gwc_time in gwc_time_remove[:1]:
-        # for gwc_time in gwc_time_remove:
-        # for gwc_time in gwc_filter_times[-1:]:
-        # for gwc_time in gwc_filter_times[:1]:
-        # test clearing the same cache just seeded to troubleshoot:
-        #for gwc_time in timestop_add[:1]:
-
-            data = truncate_template_time
-            data['seedRequest']['name'] = args.layer_id
-            data['seedRequest']['srs']['number'] = 4326
-            data['seedRequest']['bounds']['coords']['double'] = grid_subsets['EPSG:4326']
-            data['seedRequest']['parameters']['entry'][0]['string'][1] = gwc_time.strftime(time_output_fmt)
-
-            print("Truncate request json for time: {time}".format(time=gwc_time.strftime(time_output_fmt)))
-            print(data)
-            if logger:
-                logger.info("Truncating GWC layer: {layer}, timestop: {stop}.  URL: {url}.".format(layer=args.layer_id,
-                                                                                                   stop=gwc_time, url=url))
-            rest_seed_truncate(url, "post", data)
+def parse_layerinfo(r, nc_layer=None):
+    """
+    :param r: requests response object from the NC LayerInfo Servlet
+    :param nc_layer: id of the nowCOAST layer to return the time stops of.  Default: the first layer in the response
+    :return: list of time stops (UTC epoch millisecond keys) of the layer
+    :raises UpdateError: if the response doesn't include the layer
+    """
+    layers = parse_layerinfo_layers(r)
+    if nc_layer is None:
+        if not layers:
+            raise UpdateError("NC LayerInfo response has no layers.  URL: {url}".format(url=r.url))
+        return next(iter(layers.values()))
+    if nc_layer not in layers:
+        raise UpdateError("NC LayerInfo response has no layer: {nc_layer}.  URL: {url}".format(nc_layer=nc_layer, url=r.url))
+    return layers[nc_layer]
 
-    # wait until we know truncate has completed before starting seeding
-    # (mostly due to 'default' time cache needing to be re-seeded on each update - cache must be fully truncated first):
-    status_url = ("/").join([args.gwc_rest_url, "seed", args.layer_id]) + ".json"
-    while True:
-        # response should look like:
-        #   running task: {"long-array-array":[[-1,-1,-2,314,2]]}
-        #   no tasks: {"long-array-array":[]}
-        r = rest_seed_truncate(url, "get")
-        truncate_status = r.json()
-        if not truncate_status['long-array-array']:
-            break
-        time.sleep(3)
 
-    ##############################################
-    # seeding:
-    ##############################################
-    # ToDo: this will all need to be wrapped in a function or iterated over by:
-    #   gridset SRS (only handles 4326 currently)
-    #   other?
+def parse_layerinfo_layers(r):
+    """
+    :param r: requests response object from the NC LayerInfo Servlet
+    :return: OrderedDict of nowCOAST layer id (str) -> list of time stops (UTC epoch millisecond keys), for every
+        layer in the response
+    """
+    layerinfo_result = r.text
 
-    # first, we want to seed the default cache (no time filter value):
-    # default cache appears to exist even if <defaultValue> is set to most recent time filter value and a time filter
-    # cache exists for this time value
-    # this will need to be truncated and re-seeded each refresh???
-    if True:
-        data = seed_template_bbox
-        data['seedRequest']['name'] = args.layer_id
-        data['seedRequest']['srs']['number'] = 4326
-        data['seedRequest']['bounds']['coords']['double'] = grid_subsets['EPSG:4326']
-        data['seedRequest']['zoomStart'] = 0
-        data['seedRequest']['zoomStop'] = 5
-        print("Seed request (default cache) json:")
-        print(data)
-        if logger: logger.info(
-            "Seeding GWC default cache for layer: {layer}. URL: {url}.".format(layer=args.layer_id, url=url))
-        rest_seed_truncate(url, "post", data)
-
-    if True:
-        timestop_add.sort(reverse=True)
-        # next, we want to seed any newly added timestops in their own time filter cache:
-        for timestop in timestop_add[:1]:
-        #for timestop in timestop_add[]]:
-
-            data = seed_template_bbox_time
-            data['seedRequest']['name'] = args.layer_id
-            data['seedRequest']['srs']['number'] = 4326
-            data['seedRequest']['bounds']['coords']['double'] = grid_subsets['EPSG:4326']
-            data['seedRequest']['zoomStart'] = 0
-            data['seedRequest']['zoomStop'] = 5
-            data['seedRequest']['parameters']['entry'][0]['string'][1] = timestop.strftime(time_output_fmt)
-
-            print("Seed request json for time: {time}".format(time=timestop.strftime(time_output_fmt)))
-            print(data)
-            if logger: logger.info(
-                "Seeding GWC layer: {layer}, timestop: {stop}.  URL: {url}.".format(layer=args.layer_id, stop=timestop,
-                                                                                    url=url))
-            rest_seed_truncate(url, "post", data)
+    # convert to json to extract timestops
+    nc_layerinfo_json = json.loads(layerinfo_result)
+    # debug:
+    #print(json.dumps(nc_layerinfo_json, indent=4))
+    #out.write(json.dumps(nc_layerinfo_json, indent=4) + "\n")
 
-    # just check the seeding status to know if it's completed
-    while True:
-        # response should look like:
-        #   running task: {"long-array-array":[[-1,-1,-2,314,2]]}
-        #   no tasks: {"long-array-array":[]}
-        r = rest_seed_truncate(url, "get")
-        truncate_status = r.json()
-        if not truncate_status['long-array-array']:
-            break
-        time.sleep(3)
+    # timeStops are already epoch milliseconds:
+    return OrderedDict((str(layer.get('id')), timecodec.from_epoch_millis(layer['timeStops']))
+                       for layer in nc_layerinfo_json['layers'])
 
 
-def rest_seed_truncate(url, method, data=None):
+def rest_request(http_client, method, url, **kwargs):
+    """
+    :param http_client: client.HTTPClient to send the request through
+    :param method: one of 'get', 'put', 'post', 'delete'
+    :param url: URL to request
+    :param kwargs: passed on to client.HTTPClient.request (params, data, json, auth, ...)
+    :return: the requests response object
+    :raises UpdateError: if the request fails after retries, or returns an error status
+    """
+    try:
+        return http_client.request(method, url, **kwargs)
+    except requests.exceptions.RequestException as err:
+        if logger: logger.error("HTTP {method} failed.  URL: {url}.  Err: {err}".format(method=method.upper(), url=url, err=err))
+        raise UpdateError("HTTP {method} failed.  URL: {url}.  Err: {err}".format(method=method.upper(), url=url, err=err))
+
+
+def rest_seed_truncate(url, method, data=None, http_client=None, auth=(GWC_USER, GWC_PASSWORD)):
     """
     :param url: GWC REST API URL
     :param method: one of 'get', 'put', 'post', 'delete'
     :param data: json to send, if any
-    :return: the requests response object if successful, otherwise, log an error (ToDo: should be thrown instead)
+    :param http_client: client.HTTPClient to send the request through.  Default: the shared default client
+    :param auth: GWC REST API (user, password)
+    :return: the requests response object
+    :raises UpdateError: if the request fails after retries, or returns an error status
     """
-    try:
-        if method.lower() == "get":
-            r = requests.get(url=url, auth=('geowebcache', 'secured'), json=data)
-        elif method.lower() == "post":
-            r = requests.post(url=url, auth=('geowebcache', 'secured'), json=data)
-        elif method.lower() == "put":
-            r = requests.put(url=url, auth=('geowebcache', 'secured'), json=data)
-        elif method.lower() == "delete":
-            r = requests.delete(url=url, auth=('geowebcache', 'secured'), json=data)
-
-        r.raise_for_status()
-        print(r.text)
-        return r
-    except requests.exceptions.HTTPError as err:
-        print(err)
\ No newline at end of file
+    if http_client is None:
+        http_client = client.default_client()
+    r = rest_request(http_client, method, url, auth=auth, json=data)
+    print(r.text)
+    return r
@@ -0,0 +1,237 @@
+"""
+Per-phase timing instrumentation of layer updates.
+
+A Recorder times each phase of a layer update (GWC layer GET/parse, source query/parse, diff, config POST, mass truncate,
+truncate/seed submission and waits, cache verification) along with what it moved: bytes, time stop counts and HTTP
+status.  Finished recordings are appended to a JSON lines file and/or merged into a Prometheus textfile (for the
+node_exporter textfile collector): the layer's series replace those of its previous update and every other layer's
+series are kept, so separate runs (eg. one cron job per layer) can share one file.  When a layer is pushed to several
+clustered GWC nodes, the per-node phases are labelled with the node's REST API URL.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+
+# phase names, in pipeline order (the source phases run concurrently with the GWC ones):
+GWC_GET = "gwc_get"
+GWC_PARSE = "gwc_parse"
+SOURCE_QUERY = "source_query"
+SOURCE_PARSE = "source_parse"
+DIFF = "diff"
+CONFIG_POST = "config_post"
+MASS_TRUNCATE = "mass_truncate"
+TRUNCATE_SUBMIT = "truncate_submit"
+TRUNCATE_WAIT = "truncate_wait"
+SEED_SUBMIT = "seed_submit"
+SEED_WAIT = "seed_wait"
+VERIFY = "verify"
+TOTAL = "total"
+
+# per phase fields, in output order:
+FIELDS = ('seconds', 'bytes', 'timestops', 'status', 'error')
+
+# Prometheus metric name and help text for each numeric field:
+PROMETHEUS_METRICS = (
+    ('seconds', 'gwc_update_phase_duration_seconds', 'Duration of the last run of each layer update phase'),
+    ('bytes', 'gwc_update_phase_bytes', 'Bytes transferred by the last run of each layer update phase'),
+    ('timestops', 'gwc_update_phase_timestops', 'Time stops handled by the last run of each layer update phase'),
+    ('status', 'gwc_update_phase_http_status', 'HTTP status of the last run of each layer update phase'),
+)
+LAST_RUN_METRICS = (
+    ('gwc_update_last_run_timestamp_seconds', 'Time the last update of each layer finished'),
+    ('gwc_update_last_run_success', 'Whether the last update of each layer succeeded'),
+)
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\{layer="((?:[^"\\]|\\.)*)"')
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+class Recorder(object):
+    """
+    Records the phases of a single layer update
+    """
+
+    def __init__(self, layer_id):
+        """
+        :param layer_id: GWC layer ID being updated
+        """
+        self.layer_id = layer_id
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        # list of phase dicts: 'phase', 'node', 'started' and FIELDS
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, node=None):
+        """
+        Time a phase.  The yielded dict can be filled in with the phase's 'bytes', 'timestops' and 'status'; 'error'
+        is set if the phase raises
+
+        :param name: phase name, eg. GWC_GET
+        :param node: GWC node the phase ran against, when a layer is pushed to several.  Default: none
+        """
+        record = dict.fromkeys(FIELDS)
+        record['phase'] = name
+        record['node'] = node
+        record['started'] = time.time()
+        self.phases.append(record)
+        start = time.time()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['seconds'] = time.time() - start
+
+    def finish(self, error=None):
+        """
+        Close the recording, adding a TOTAL phase for the whole update
+
+        :param error: exception the update failed with, if any
+        """
+        self.finished = time.time()
+        self.error = type(error).__name__ if error is not None else None
+        total = dict.fromkeys(FIELDS)
+        total.update({'phase': TOTAL, 'node': None, 'started': self.started, 'seconds': self.finished - self.started,
+                      'error': self.error})
+        self.phases.append(total)
+
+    def lines(self):
+        """
+        :return: list of JSON strings, one per phase
+        """
+        lines = []
+        for record in self.phases:
+            line = {'time': record['started'], 'layer': self.layer_id, 'phase': record['phase']}
+            if record.get('node'):
+                line['node'] = record['node']
+            line.update((field, record[field]) for field in FIELDS)
+            lines.append(json.dumps(line, sort_keys=True))
+        return lines
+
+
+def export(recorder, jsonl=None, prometheus=None):
+    """
+    Write a finished recording out.  Write failures are logged, they never fail the update
+
+    :param recorder: the finished Recorder
+    :param jsonl: JSON lines file to append the recorder's phases to
+    :param prometheus: Prometheus textfile to merge the recorder's layer's series into, see update_prometheus()
+    """
+    with _lock:
+        try:
+            if jsonl:
+                with open(jsonl, 'a') as f:
+                    for line in recorder.lines():
+                        f.write(line + "\n")
+            if prometheus:
+                update_prometheus(prometheus, recorder)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to write metrics for GWC layer: {layer}.  Err: {err}".format(
+                layer=recorder.layer_id, err=e))
+
+
+def update_prometheus(filename, recorder):
+    """
+    Replace the series of recorder's layer in a Prometheus textfile, keeping every other layer's.  The file is locked
+    while it's read and rewritten, and replaced atomically so it's never scraped half written
+
+    :param filename: textfile to update, eg. /var/lib/node_exporter/textfile_collector/gwc.prom
+    :param recorder: the finished Recorder
+    """
+    layer = _escape(recorder.layer_id)
+    with _file_lock(filename):
+        samples = [sample for sample in read_samples(filename) if sample[1] != layer]
+        write_samples(filename, samples + samples_of(recorder))
+
+
+def samples_of(recorder):
+    """
+    :param recorder: a finished Recorder
+    :return: list of the recorder's Prometheus samples, tuples of (metric name, escaped layer label, sample line)
+    """
+    layer = _escape(recorder.layer_id)
+    samples = []
+    for field, name, _ in PROMETHEUS_METRICS:
+        for record in recorder.phases:
+            if record[field] is not None:
+                node = ',node="{node}"'.format(node=_escape(record['node'])) if record.get('node') else ''
+                samples.append((name, layer, '{name}{{layer="{layer}",phase="{phase}"{node}}} {value}'.format(
+                    name=name, layer=layer, phase=record['phase'], node=node, value=record[field])))
+    values = (recorder.finished, 0 if recorder.error else 1)
+    for (name, _), value in zip(LAST_RUN_METRICS, values):
+        samples.append((name, layer, '{name}{{layer="{layer}"}} {value}'.format(name=name, layer=layer, value=value)))
+    return samples
+
+
+def read_samples(filename):
+    """
+    :param filename: Prometheus textfile written by write_samples()
+    :return: list of its samples, see samples_of(), or an empty list if there's no such file
+    """
+    names = set(name for _, name, _ in PROMETHEUS_METRICS) | set(name for name, _ in LAST_RUN_METRICS)
+    samples = []
+    try:
+        with open(filename) as f:
+            for line in f:
+                match = _SAMPLE_RE.match(line)
+                if match and match.group(1) in names:
+                    samples.append((match.group(1), match.group(2), line.rstrip("\n")))
+    except (IOError, OSError):
+        if os.path.exists(filename):
+            raise
+    return samples
+
+
+def write_samples(filename, samples):
+    """
+    Write samples as a Prometheus textfile, grouped by metric, replacing filename atomically
+
+    :param filename: textfile to write
+    :param samples: list of samples, see samples_of()
+    """
+    out = []
+    metrics = [(name, help_text) for _, name, help_text in PROMETHEUS_METRICS] + list(LAST_RUN_METRICS)
+    for name, help_text in metrics:
+        out.append("# HELP {name} {help}".format(name=name, help=help_text))
+        out.append("# TYPE {name} gauge".format(name=name))
+        # sorted by layer (stable, so each layer's phases stay in pipeline order):
+        out.extend(line for _, _, line in sorted((sample for sample in samples if sample[0] == name),
+                                                 key=lambda sample: sample[1]))
+
+    tmp = "{filename}.{pid}.tmp".format(filename=filename, pid=os.getpid())
+    with open(tmp, 'w') as f:
+        f.write("\n".join(out) + "\n")
+    os.rename(tmp, filename)
+
+
+@contextmanager
+def _file_lock(filename):
+    # serializes the read-modify-write of a textfile shared by separate processes:
+    if fcntl is None:
+        yield
+        return
+    with open(filename + ".lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
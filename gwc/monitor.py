@@ -0,0 +1,263 @@
+"""
+Progress monitoring of the GWC seed/truncate tasks submitted by a layer update.
+
+GWC reports the tasks running for a layer at /seed/<layer>.json as {"long-array-array": [[...], ...]}, one array per
+task: [tiles done, tiles total, estimated seconds remaining, task id, task status].  SeedMonitor decodes those into
+per-task progress, tracks only the tasks this run submitted, and polls adaptively: backing off while tasks run long and
+tightening as they near completion.  GWC runs each thread of a seed request as a task of its own.
+
+A ThreadController can be fed the tile throughput of every poll, to adapt the threadCount of the seed jobs submitted
+later in the run.
+"""
+import logging
+import time
+from collections import namedtuple
+
+MIN_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 30.0
+POLL_BACKOFF = 1.5
+
+# ThreadController: weight of the latest throughput in the smoothed rate, polls to observe a thread count for before
+# changing it, and the relative throughput change that counts as better/worse:
+SMOOTHING = 0.5
+ADAPT_SAMPLES = 2
+MIN_GAIN = 0.05
+
+# GWC task status codes:
+ABORTED = -1
+PENDING = 0
+RUNNING = 1
+DONE = 2
+
+logger = logging.getLogger(__name__)
+
+# tiles_done/tiles_total are -1 and time_remaining is -2 when GWC doesn't know them (eg. for truncate tasks)
+TaskProgress = namedtuple('TaskProgress', ['task_id', 'tiles_done', 'tiles_total', 'time_remaining', 'status'])
+
+
+def decode_status(status):
+    """
+    :param status: GWC seed status json, eg. {"long-array-array": [[-1, -1, -2, 314, 2]]}
+    :return: list of TaskProgress, one per task
+    """
+    return [TaskProgress(row[3], row[0], row[1], row[2], row[4]) for row in status.get('long-array-array', [])]
+
+
+class SeedMonitor(object):
+    """
+    Tracks the GWC tasks submitted by this run for a single layer
+    """
+
+    def __init__(self, get_status, kill_task, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL,
+                 controller=None):
+        """
+        :param get_status: callable returning the layer's GWC seed status json
+        :param kill_task: callable taking a task id, to kill that GWC task
+        :param min_interval: shortest time (seconds) between status polls
+        :param max_interval: longest time (seconds) between status polls
+        :param controller: ThreadController to feed the throughput of every poll to.  Default: none
+        """
+        self.get_status = get_status
+        self.kill_task = kill_task
+        self.controller = controller
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        # ids of tasks seen before they could have been ours, and of the tasks this run submitted:
+        self.foreign = set()
+        self.tracked = set()
+        self.tasks = []
+        self.throughput = 0.0
+        self._last_poll = None
+        # TaskProgress of the tracked tasks with known tile counts, as of the last poll:
+        self._last_tasks = {}
+
+    def poll(self):
+        """
+        :return: list of TaskProgress for every task currently running on the layer
+        """
+        now = time.time()
+        self.tasks = decode_status(self.get_status())
+
+        # tiles/s across this run's tasks since the last poll, counting the tasks that finished since as done:
+        tasks = dict((task.task_id, task) for task in self.tasks
+                     if task.task_id in self.tracked and task.tiles_done >= 0)
+        if self._last_poll is not None and now > self._last_poll:
+            delta = 0
+            for task_id, last in self._last_tasks.items():
+                if task_id in tasks:
+                    delta += tasks[task_id].tiles_done - last.tiles_done
+                elif last.tiles_total >= 0:
+                    delta += last.tiles_total - last.tiles_done
+            self.throughput = max(0, delta) / (now - self._last_poll)
+            # a job's threads start and finish together, so the rate only reflects a thread count while the same
+            # tasks run through the whole interval:
+            if self.controller is not None and tasks and set(tasks) == set(self._last_tasks):
+                self.controller.observe(self.throughput, len(self.running()))
+        self._last_poll, self._last_tasks = now, tasks
+        return self.tasks
+
+    def snapshot(self):
+        """
+        Record the tasks already running on the layer, so they're never mistaken for ones this run submits
+        """
+        self.foreign.update(task.task_id for task in self.poll())
+
+    def claim(self):
+        """
+        Start tracking the tasks that appeared since the last snapshot()/claim(), after submitting new jobs
+
+        :return: the ids of the newly tracked tasks
+        """
+        new = set(task.task_id for task in self.poll()) - self.foreign - self.tracked
+        self.tracked.update(new)
+        return new
+
+    def running(self):
+        """
+        :return: list of TaskProgress of the tracked tasks still running, as of the last poll
+        """
+        return [task for task in self.tasks if task.task_id in self.tracked]
+
+    def eta(self):
+        """
+        :return: estimated seconds until the tracked tasks complete, or None if unknown
+        """
+        running = self.running()
+        estimates = [task.time_remaining for task in running if task.time_remaining >= 0]
+        remaining = sum(task.tiles_total - task.tiles_done for task in running if task.tiles_total >= 0)
+        if remaining and self.throughput > 0:
+            estimates.append(remaining / self.throughput)
+        return max(estimates) if estimates else None
+
+    def wait(self, deadline=None, max_tasks=None):
+        """
+        Poll until the tracked tasks complete (or, with max_tasks, until fewer than max_tasks tasks are running on
+        the layer)
+
+        :param deadline: time.time() value to give up at.  Default: no deadline
+        :param max_tasks: wait for capacity to submit more jobs instead of for completion
+        :return: True if the condition was met, False if the deadline passed first
+        """
+        self.interval = self.min_interval
+        while True:
+            self.poll()
+            if max_tasks is not None:
+                if len(self.tasks) < max_tasks:
+                    return True
+            elif not self.running():
+                return True
+
+            self.report()
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                return False
+            interval = self._next_interval()
+            if deadline is not None:
+                interval = min(interval, deadline - now)
+            time.sleep(interval)
+
+    def kill_running(self):
+        """
+        Kill the tracked tasks still running through the GWC REST API
+
+        :return: list of killed task ids
+        """
+        killed = []
+        for task in self.running():
+            logger.warning("Killing GWC task: {task}".format(task=task.task_id))
+            self.kill_task(task.task_id)
+            killed.append(task.task_id)
+        return killed
+
+    def report(self):
+        """
+        Print progress of the tracked tasks
+        """
+        for task in self.running():
+            if task.tiles_total > 0:
+                print("Task {task}: {done}/{total} tiles ({percent:.0f}%), {remaining}s remaining".format(
+                    task=task.task_id, done=task.tiles_done, total=task.tiles_total,
+                    percent=100.0 * task.tiles_done / task.tiles_total, remaining=task.time_remaining))
+            else:
+                print("Task {task}: running".format(task=task.task_id))
+        eta = self.eta()
+        print("{count} tasks running, {rate:.1f} tiles/s, ETA: {eta}".format(
+            count=len(self.running()), rate=self.throughput, eta="{0:.0f}s".format(eta) if eta is not None else "unknown"))
+
+    def _next_interval(self):
+        eta = self.eta()
+        if eta is not None:
+            # poll about twice before the expected completion, so we tighten up as the tasks near the end:
+            interval = eta / 2
+        else:
+            interval = self.interval * POLL_BACKOFF
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        return self.interval
+
+
+class ThreadController(object):
+    """
+    Adapts the threadCount of seed jobs to the tile throughput GWC reports: a thread is added while throughput keeps
+    improving and dropped when it falls, and the thread count is halved (and capped) whenever the render latency, the
+    running threads over the tiles/s they achieve, passes a ceiling
+    """
+
+    def __init__(self, thread_count, min_threads=1, max_threads=None, max_latency=None, samples=ADAPT_SAMPLES):
+        """
+        :param thread_count: threadCount to start with
+        :param min_threads: lowest threadCount to go to
+        :param max_threads: highest threadCount to go to.  Default: no limit
+        :param max_latency: ceiling in seconds per tile per thread.  Default: none, maximize throughput
+        :param samples: polls to observe a threadCount for before changing it
+        """
+        self.thread_count = thread_count
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+        self.max_latency = max_latency
+        self.samples = samples
+        # smoothed tiles/s and latency at the current threadCount, and the tiles/s at the previous one:
+        self.rate = None
+        self.latency = None
+        self.best = None
+        self._observed = 0
+
+    def observe(self, throughput, threads):
+        """
+        :param throughput: tiles/s of the run's running tasks since the last poll
+        :param threads: number of the run's tasks (GWC seed threads) running
+        :return: the threadCount for jobs submitted next
+        """
+        if throughput <= 0 or threads <= 0:
+            return self.thread_count
+        self.rate = throughput if self.rate is None else SMOOTHING * throughput + (1 - SMOOTHING) * self.rate
+        self.latency = float(threads) / self.rate
+        self._observed += 1
+        if self._observed < self.samples:
+            return self.thread_count
+
+        if self.max_latency and self.latency > self.max_latency:
+            # the backend is saturated: back off hard and don't climb back to where it was
+            self.max_threads = max(self.min_threads, self.thread_count - 1)
+            self.best = None
+            self._change(self.thread_count // 2, "latency {latency:.2f}s over {ceiling}s".format(
+                latency=self.latency, ceiling=self.max_latency))
+        elif self.best is None or self.rate > self.best * (1 + MIN_GAIN):
+            self.best = self.rate
+            self._change(self.thread_count + 1, "{rate:.1f} tiles/s".format(rate=self.rate))
+        elif self.rate < self.best * (1 - MIN_GAIN):
+            # past the backend's peak: step back and stay below this threadCount
+            self.max_threads = max(self.min_threads, self.thread_count - 1)
+            self.best = None
+            self._change(self.thread_count - 1, "{rate:.1f} tiles/s".format(rate=self.rate))
+        return self.thread_count
+
+    def _change(self, thread_count, reason):
+        thread_count = max(self.min_threads, thread_count)
+        if self.max_threads is not None:
+            thread_count = min(self.max_threads, thread_count)
+        if thread_count != self.thread_count:
+            logger.info("Seed threadCount {old} -> {new} ({reason})".format(old=self.thread_count, new=thread_count,
+                                                                          reason=reason))
+            self.thread_count = thread_count
+            self.rate, self._observed = None, 0
@@ -0,0 +1,371 @@
+"""
+Planning of GWC seed and truncate jobs for a layer update.
+
+Turns the result of a time filter reconciliation into a deduplicated, ordered list of SeedJobs covering every new or
+expired time stop and every gridset in the layer's gridSubsets, with configurable zoom ranges per gridset.  The tiles a
+seed job covers are estimated per zoom level from the gridset's tile matrix and the job's bounds, so the seed jobs of an
+update can be cut back to the deepest zoom level that fits a tile budget.
+
+GWC REST seedRequest format, from the docs:
+    {
+        "seedRequest": {
+            "name": "topp:states",
+            "bounds": {"coords": {"double": ["-180", "-90", "180", "90"]}},
+            "srs": {"number": 4326},
+            "zoomStart": 1,
+            "zoomStop": 12,
+            "format": "image\\/png",
+            "type": "seed",       (or "reseed", "truncate")
+            "threadCount": 4,
+            "parameters": {"entry": [{"string": ["TIME", "2017-09-13T12:56:00"]}]}
+        }
+    }
+
+Expired time caches can instead be dropped in bulk through GWC's /rest/masstruncate, which deletes whole parameter set
+caches rather than walking every tile:
+    <truncateOrphans><layerName>topp:states</layerName></truncateOrphans>
+        (every parameter set cache the layer's parameter filters no longer allow, GWC 1.12+)
+    <truncateParameters><layerName>topp:states</layerName>
+        <parameters><entry><string>TIME</string><string>2017-09-13T12:56:00</string></entry></parameters>
+    </truncateParameters>
+        (a single parameter set cache)
+"""
+import logging
+import math
+import re
+from collections import namedtuple
+
+SEED = "seed"
+TRUNCATE = "truncate"
+
+SEED_ZOOM = "0-5"
+TRUNCATE_ZOOM = "0-20"
+SEED_THREAD_COUNT = 4
+TRUNCATE_THREAD_COUNT = 1
+SEED_THREAD_BUDGET = 8
+TILE_FORMAT = "image/png"
+
+# how expired time caches are truncated, each mode falling back to the next if GWC rejects it:
+TRUNCATE_ORPHANS = "orphans"
+TRUNCATE_PARAMETERS = "parameters"
+TRUNCATE_SEED = "seed"
+TRUNCATE_MODES = (TRUNCATE_ORPHANS, TRUNCATE_PARAMETERS, TRUNCATE_SEED)
+
+_EPSG_RE = re.compile(r'^EPSG:(\d+)$', re.IGNORECASE)
+
+# tile matrix of a gridset: extent (minx, miny, maxx, maxy) and the number of tiles across and down at zoom level 0,
+# doubling with every level
+TileMatrix = namedtuple('TileMatrix', ['extent', 'tiles_wide', 'tiles_high'])
+
+_MERCATOR = TileMatrix((-20037508.34, -20037508.34, 20037508.34, 20037508.34), 1, 1)
+_GEOGRAPHIC = TileMatrix((-180.0, -90.0, 180.0, 90.0), 2, 1)
+# GWC's built in gridsets:
+GRIDSETS = {
+    'EPSG:4326': _GEOGRAPHIC,
+    'GlobalCRS84Geometric': _GEOGRAPHIC,
+    'EPSG:900913': _MERCATOR,
+    'EPSG:3857': _MERCATOR,
+    'GoogleMapsCompatible': _MERCATOR,
+}
+
+logger = logging.getLogger(__name__)
+
+# a gridSubset of the layer config: gridset name, bounds (list of 4 coordinate strings, or None for the full gridset
+# extent) and the zoom levels the layer is configured for (None if not restricted)
+GridSubset = namedtuple('GridSubset', ['name', 'bounds', 'zoom_start', 'zoom_stop'])
+
+# time_key is None for the layer's default (no TIME parameter) cache.  time_value is the exact TIME string to send,
+# for truncating caches of filter values written in another format (GWC keys parameter caches by the string), or None
+# to format time_key
+SeedJob = namedtuple('SeedJob', ['type', 'gridset', 'bounds', 'zoom_start', 'zoom_stop', 'time_key', 'time_value'])
+SeedJob.__new__.__defaults__ = (None,)
+
+
+def parse_grid_subsets(root):
+    """
+    :param root: lxml root element of the GWC layer config XML
+    :return: dict of gridset name -> GridSubset, in config order
+    """
+    grid_subsets = {}
+    for grid in root.xpath("//gridSubsets/gridSubset"):
+        name = grid.findtext("gridSetName")
+        coords = grid.find("extent/coords")
+        bounds = [bound.text for bound in coords.iter("double")] if coords is not None else None
+        zoom_start, zoom_stop = grid.findtext("zoomStart"), grid.findtext("zoomStop")
+        grid_subsets[name] = GridSubset(name, bounds,
+                                        int(zoom_start) if zoom_start is not None else None,
+                                        int(zoom_stop) if zoom_stop is not None else None)
+    return grid_subsets
+
+
+def parse_zoom(text):
+    """
+    :param text: zoom range 'START-STOP' (eg. '0-5'), or a single zoom level
+    :return: tuple of (zoom_start, zoom_stop)
+    :raises ValueError: if text isn't a valid zoom range
+    """
+    parts = str(text).split("-")
+    if len(parts) == 1:
+        parts = parts * 2
+    zoom_start, zoom_stop = int(parts[0]), int(parts[1])
+    if zoom_start < 0 or zoom_stop < zoom_start:
+        raise ValueError("Invalid zoom range: {zoom}".format(zoom=text))
+    return zoom_start, zoom_stop
+
+
+def parse_gridset_zooms(values):
+    """
+    :param values: per gridset zoom ranges, either a list of 'GRIDSET=START-STOP' strings (command line) or a dict of
+        gridset name -> 'START-STOP' (batch config)
+    :return: dict of gridset name -> (zoom_start, zoom_stop)
+    :raises ValueError: if a value isn't valid
+    """
+    if not values:
+        return {}
+    if isinstance(values, dict):
+        items = values.items()
+    else:
+        items = []
+        for value in values:
+            if "=" not in value:
+                raise ValueError("Invalid gridset zoom range, expected GRIDSET=START-STOP: {value}".format(value=value))
+            items.append(value.rsplit("=", 1))
+    return dict((gridset, parse_zoom(zoom)) for gridset, zoom in items)
+
+
+class Planner(object):
+    """
+    Builds the seed and truncate jobs for a layer's gridsets
+    """
+
+    def __init__(self, grid_subsets, gridsets=None, seed_zoom=SEED_ZOOM, truncate_zoom=TRUNCATE_ZOOM,
+                 gridset_zooms=None):
+        """
+        :param grid_subsets: dict of gridset name -> GridSubset, see parse_grid_subsets()
+        :param gridsets: names of the gridsets to seed/truncate.  Default: all of grid_subsets
+        :param seed_zoom: default seed zoom range 'START-STOP'
+        :param truncate_zoom: truncate zoom range 'START-STOP'
+        :param gridset_zooms: dict of gridset name -> (zoom_start, zoom_stop) seed zoom overrides, see
+            parse_gridset_zooms()
+        :raises ValueError: if gridsets or gridset_zooms name a gridset the layer has no gridSubset for
+        """
+        unknown = [name for name in list(gridsets or ()) + list(gridset_zooms or ()) if name not in grid_subsets]
+        if unknown:
+            raise ValueError("Unknown gridsets: {unknown}, the layer's gridSubsets are: {known}".format(
+                unknown=", ".join(unknown), known=", ".join(grid_subsets)))
+        if gridsets:
+            self.grid_subsets = [grid_subsets[name] for name in gridsets]
+        else:
+            self.grid_subsets = list(grid_subsets.values())
+        self.seed_zoom = parse_zoom(seed_zoom)
+        self.truncate_zoom = parse_zoom(truncate_zoom)
+        self.gridset_zooms = gridset_zooms or {}
+
+    def plan(self, job_type, time_keys, default_cache=True, time_values=None):
+        """
+        :param job_type: SEED or TRUNCATE
+        :param time_keys: epoch keys of the time stops to seed/truncate
+        :param default_cache: also include the default (no TIME parameter) cache of each gridset
+        :param time_values: dict of epoch key -> list of the exact TIME filter value strings of that time stop, one job
+            per string (eg. the expired filter values to truncate).  Default: format each key
+        :return: list of unique SeedJobs: default caches first, then time stops newest first, each across all gridsets
+        """
+        times = sorted(set(time_keys), reverse=True)
+        if default_cache:
+            times.insert(0, None)
+
+        jobs = []
+        for time_key in times:
+            values = (time_values or {}).get(time_key) or [None]
+            for time_value in sorted(set(values), key=values.index):
+                for grid in self.grid_subsets:
+                    zoom_start, zoom_stop = self._zoom(job_type, grid)
+                    if zoom_start is None:
+                        continue
+                    jobs.append(SeedJob(job_type, grid.name, grid.bounds, zoom_start, zoom_stop, time_key, time_value))
+        return jobs
+
+    def _zoom(self, job_type, grid):
+        if job_type == TRUNCATE:
+            zoom_start, zoom_stop = self.truncate_zoom
+        else:
+            zoom_start, zoom_stop = self.gridset_zooms.get(grid.name, self.seed_zoom)
+        # clip to the zoom levels the layer is configured for on this gridset:
+        if grid.zoom_start is not None:
+            zoom_start = max(zoom_start, grid.zoom_start)
+        if grid.zoom_stop is not None:
+            zoom_stop = min(zoom_stop, grid.zoom_stop)
+        if zoom_stop < zoom_start:
+            return None, None
+        return zoom_start, zoom_stop
+
+
+def tile_count(gridset, bounds, zoom):
+    """
+    :param gridset: gridset name, one of GRIDSETS
+    :param bounds: list of 4 coordinate strings (minx, miny, maxx, maxy), or None for the full gridset extent
+    :param zoom: zoom level
+    :return: number of tiles covering bounds at zoom, or None if the gridset's tile matrix isn't known
+    """
+    tiles = tile_range(gridset, bounds, zoom)
+    if tiles is None:
+        return None
+    col_min, col_max, row_min, row_max = tiles
+    return max(0, col_max - col_min + 1) * max(0, row_max - row_min + 1)
+
+
+def tile_range(gridset, bounds, zoom):
+    """
+    :param gridset: gridset name, one of GRIDSETS
+    :param bounds: list of 4 coordinate strings (minx, miny, maxx, maxy), or None for the full gridset extent
+    :param zoom: zoom level
+    :return: tuple of the (col_min, col_max, row_min, row_max) tiles covering bounds at zoom, rows counted from the top
+        as in WMTS (empty if max < min), or None if the gridset's tile matrix isn't known
+    """
+    matrix = GRIDSETS.get(gridset)
+    if matrix is None:
+        return None
+    minx, miny, maxx, maxy = matrix.extent
+    tiles_wide, tiles_high = matrix.tiles_wide * 2 ** zoom, matrix.tiles_high * 2 ** zoom
+    if not bounds:
+        return 0, tiles_wide - 1, 0, tiles_high - 1
+    bounds = [float(bound) for bound in bounds]
+    col_min, col_max = _tile_span(bounds[0], bounds[2], minx, maxx, tiles_wide)
+    bottom, top = _tile_span(bounds[1], bounds[3], miny, maxy, tiles_high)
+    return col_min, col_max, tiles_high - 1 - top, tiles_high - 1 - bottom
+
+
+def _tile_span(low, high, extent_low, extent_high, tiles):
+    # first and last tile along one axis touched by [low, high], clipped to the extent:
+    size = (extent_high - extent_low) / tiles
+    first = max(0, int(math.floor((low - extent_low) / size)))
+    last = min(tiles - 1, int(math.ceil((high - extent_low) / size)) - 1)
+    return first, last
+
+
+def job_tiles(job, zoom_stop=None):
+    """
+    :param job: the SeedJob
+    :param zoom_stop: deepest zoom level to count.  Default: the job's zoom_stop
+    :return: number of tiles the job covers, or None if its gridset's tile matrix isn't known
+    """
+    zoom_stop = job.zoom_stop if zoom_stop is None else min(zoom_stop, job.zoom_stop)
+    total = 0
+    for zoom in range(job.zoom_start, zoom_stop + 1):
+        tiles = tile_count(job.gridset, job.bounds, zoom)
+        if tiles is None:
+            return None
+        total += tiles
+    return total
+
+
+def fit_budget(jobs, max_tiles):
+    """
+    Cut seed jobs back to the deepest common zoom level whose tiles, across every job, fit within max_tiles.  Jobs on
+    gridsets without a known tile matrix can't be estimated and are left as they are
+
+    :param jobs: list of SeedJob
+    :param max_tiles: tile budget of the jobs
+    :return: tuple of (list of SeedJob, estimated tiles of the estimable jobs, zoom_stop the jobs were cut back to or
+        None if they all fit)
+    """
+    estimable = [job for job in jobs if job_tiles(job, zoom_stop=job.zoom_start) is not None]
+    for gridset in sorted(set(job.gridset for job in jobs) - set(job.gridset for job in estimable)):
+        logger.warning("Unknown tile matrix of gridset: {gridset}, its seed jobs aren't budgeted".format(gridset=gridset))
+    if not estimable:
+        return jobs, 0, None
+
+    deepest = max(job.zoom_stop for job in estimable)
+    shallowest = min(job.zoom_start for job in estimable)
+    zoom_stop = deepest
+    tiles = sum(job_tiles(job) for job in estimable)
+    while tiles > max_tiles and zoom_stop > shallowest:
+        zoom_stop -= 1
+        tiles = sum(job_tiles(job, zoom_stop=zoom_stop) for job in estimable if job.zoom_start <= zoom_stop)
+    if zoom_stop == deepest:
+        return jobs, tiles, None
+
+    # jobs starting below the chosen level are dropped, the rest stop at it:
+    estimable_ids = set(id(job) for job in estimable)
+    fitted = []
+    for job in jobs:
+        if id(job) in estimable_ids:
+            if job.zoom_start > zoom_stop:
+                continue
+            job = job._replace(zoom_stop=min(job.zoom_stop, zoom_stop))
+        fitted.append(job)
+    return fitted, tiles, zoom_stop
+
+
+def seed_request(job, layer_id, formatter, thread_count, tile_format=TILE_FORMAT):
+    """
+    :param job: the SeedJob
+    :param layer_id: GWC layer ID
+    :param formatter: timecodec.Formatter to write the TIME parameter with
+    :param thread_count: number of GWC threads to run the job with
+    :param tile_format: tile MIME type to seed/truncate
+    :return: the GWC REST 'seedRequest' dict for job
+    """
+    request = {
+        "name": layer_id,
+        "zoomStart": job.zoom_start,
+        "zoomStop": job.zoom_stop,
+        "format": tile_format,
+        "type": job.type,
+        "threadCount": thread_count,
+    }
+    epsg = _EPSG_RE.match(job.gridset)
+    if epsg:
+        request["srs"] = {"number": int(epsg.group(1))}
+    else:
+        request["gridSetId"] = job.gridset
+    if job.bounds:
+        request["bounds"] = {"coords": {"double": list(job.bounds)}}
+    if job.time_key is not None:
+        request["parameters"] = {"entry": [{"string": ["TIME", time_parameter(job, formatter)]}]}
+    return {"seedRequest": request}
+
+
+def time_parameter(job, formatter):
+    """
+    :return: the TIME parameter string of job's cache, or None for the default cache
+    """
+    if job.time_key is None:
+        return None
+    return job.time_value if job.time_value is not None else formatter.format(job.time_key)
+
+
+def describe(job, formatter):
+    """
+    :return: short description of job for logging, eg. 'seed EPSG:4326 z0-5 TIME=2017-09-06T13:00:00.000Z'
+    """
+    return "{type} {gridset} z{start}-{stop} {time}".format(
+        type=job.type, gridset=job.gridset, start=job.zoom_start, stop=job.zoom_stop,
+        time="TIME=" + time_parameter(job, formatter) if job.time_key is not None else "default cache")
+
+
+def truncate_orphans_request(layer_id):
+    """
+    :param layer_id: GWC layer ID
+    :return: GWC masstruncate request body (bytes) dropping every parameter set cache of the layer that its parameter
+        filters no longer allow
+    """
+    from lxml import etree
+    root = etree.Element("truncateOrphans")
+    etree.SubElement(root, "layerName").text = layer_id
+    return etree.tostring(root, encoding="UTF-8")
+
+
+def truncate_parameters_request(layer_id, time_value):
+    """
+    :param layer_id: GWC layer ID
+    :param time_value: TIME parameter value of the cache to drop, exactly as it was in the layer's TIME filter
+    :return: GWC masstruncate request body (bytes) dropping the layer's TIME=time_value parameter set cache
+    """
+    from lxml import etree
+    root = etree.Element("truncateParameters")
+    etree.SubElement(root, "layerName").text = layer_id
+    entry = etree.SubElement(etree.SubElement(root, "parameters"), "entry")
+    etree.SubElement(entry, "string").text = "TIME"
+    etree.SubElement(entry, "string").text = time_value
+    return etree.tostring(root, encoding="UTF-8")
@@ -0,0 +1,86 @@
+"""
+Local snapshots of the state each layer update left GWC in, so unchanged layers can skip reading the GWC layer config.
+
+One small JSON file per layer in a state directory records the fingerprint of the source time stops last applied, the
+fingerprint of the resulting GWC TIME filter and its default time, and when the GWC config was last read or written.
+While a snapshot is fresh and the source time stops still match it, an update ends after the source query.
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+try:
+    from urllib.parse import quote  # Python 3
+except ImportError:
+    from urllib import quote  # Python 2
+
+# seconds a snapshot is trusted for before the GWC config is read again to catch changes made outside this tool:
+MAX_AGE = 3600
+
+logger = logging.getLogger(__name__)
+
+# source: timeindex.fingerprint() of the source time stops last applied
+# filter: timeindex.fingerprint() of the GWC TIME filter times after that update
+# default: epoch key of the GWC TIME filter <defaultValue> after that update
+# verified: time.time() the GWC config was last read or written
+Snapshot = namedtuple('Snapshot', ['layer_id', 'source', 'filter', 'default', 'verified'])
+
+
+def path(state_dir, layer_id):
+    """
+    :return: the snapshot file of layer_id in state_dir
+    """
+    return os.path.join(state_dir, quote(layer_id, safe='') + ".json")
+
+
+def load(state_dir, layer_id):
+    """
+    :param state_dir: directory holding the snapshots
+    :param layer_id: GWC layer ID
+    :return: the layer's Snapshot, or None if there isn't a (readable) one
+    """
+    filename = path(state_dir, layer_id)
+    try:
+        with open(filename) as f:
+            snapshot = Snapshot(**json.load(f))
+    except (IOError, OSError):
+        return None
+    except (ValueError, TypeError) as e:
+        logger.warning("Ignoring unreadable state snapshot: {file}.  Err: {err}".format(file=filename, err=e))
+        return None
+    return snapshot if snapshot.layer_id == layer_id else None
+
+
+def save(state_dir, snapshot):
+    """
+    Write a layer's snapshot, replacing the previous one atomically.  Write failures are logged, they never fail the
+    update
+
+    :param state_dir: directory holding the snapshots, created if needed
+    :param snapshot: the Snapshot to write
+    """
+    filename = path(state_dir, snapshot.layer_id)
+    tmp = "{filename}.{pid}.tmp".format(filename=filename, pid=os.getpid())
+    try:
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        with open(tmp, 'w') as f:
+            json.dump(snapshot._asdict(), f, sort_keys=True)
+        os.rename(tmp, filename)
+    except (IOError, OSError) as e:
+        logger.warning("Unable to write state snapshot: {file}.  Err: {err}".format(file=filename, err=e))
+
+
+def is_fresh(snapshot, max_age=MAX_AGE, now=None):
+    """
+    :param snapshot: a Snapshot, or None
+    :param max_age: seconds since the GWC config was last read or written that the snapshot is trusted for
+    :param now: current time.time().  Default: now
+    :return: True if snapshot can stand in for reading the GWC config
+    """
+    if snapshot is None:
+        return False
+    now = time.time() if now is None else now
+    return 0 <= now - snapshot.verified < max_age
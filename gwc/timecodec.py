@@ -0,0 +1,143 @@
+"""
+Timestamp codec for the time formats this tool reads and writes.
+
+Times are handled as integer UTC epoch milliseconds ('keys').  The formats GeoServer, GWC and the nowCOAST LayerInfo
+Servlet actually use (RFC3339 with milliseconds and 'Z', plain ISO8601, epoch milliseconds) are parsed and rendered
+directly; dateutil is only imported, and used, as a fallback for strings that don't match.
+"""
+import calendar
+import re
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+# named output formats, as accepted by --time_output_fmt:
+RFC3339 = "rfc3339"
+ISO8601 = "iso8601"
+
+_ISO_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?'
+                     r'(Z|z|[+-]\d{2}(?::?\d{2})?)?$')
+
+
+def epoch_key(dt):
+    """
+    :param dt: a datetime.  Naive datetimes are assumed to already be in UTC
+    :return: integer UTC epoch milliseconds for dt
+    """
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    return calendar.timegm(dt.timetuple()) * 1000 + dt.microsecond // 1000
+
+
+def key_to_datetime(key):
+    """
+    :param key: integer UTC epoch milliseconds
+    :return: naive UTC datetime for key
+    """
+    return EPOCH + timedelta(milliseconds=key)
+
+
+def parse(text):
+    """
+    :param text: time string, eg. 2017-09-06T13:00:00.000Z or 2017-09-12T11:44:00.  Strings without a UTC offset are
+        assumed to be UTC
+    :return: integer UTC epoch milliseconds for text
+    :raises ValueError: if text can't be parsed as a time
+    """
+    text = text.strip()
+    match = _ISO_RE.match(text)
+    if match is not None:
+        try:
+            return _iso_key(match)
+        except ValueError:
+            # out of range fields (eg. hour 24), leave it to dateutil:
+            pass
+    import dateutil.parser
+    return epoch_key(dateutil.parser.parse(text))
+
+
+def parse_many(texts):
+    """
+    :param texts: iterable of time strings, see parse()
+    :return: list of integer UTC epoch milliseconds, in the order of texts
+    """
+    # bind locals once, this is called with thousands of values:
+    match_iso, iso_key, fallback = _ISO_RE.match, _iso_key, parse
+    keys = []
+    for text in texts:
+        match = match_iso(text.strip())
+        if match is not None:
+            try:
+                keys.append(iso_key(match))
+                continue
+            except ValueError:
+                pass
+        keys.append(fallback(text))
+    return keys
+
+
+def from_epoch_millis(stops):
+    """
+    :param stops: iterable of epoch milliseconds, as returned by the nowCOAST LayerInfo Servlet 'timeStops'
+    :return: list of integer UTC epoch milliseconds
+    """
+    return [int(stop) for stop in stops]
+
+
+def _iso_key(match):
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    hour, minute, second = int(hour), int(minute), int(second or 0)
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError("time out of range")
+    days = datetime(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+    key = (days * 86400 + hour * 3600 + minute * 60 + second) * 1000
+    if fraction:
+        key += int((fraction + "00")[:3])
+    if offset and offset not in ("Z", "z"):
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        key -= sign * (int(digits[:2]) * 60 + int(digits[2:4] or 0)) * 60000
+    return key
+
+
+class Formatter(object):
+    """
+    Renders epoch keys as time strings, formatting each distinct key only once
+    """
+
+    def __init__(self, time_output_fmt):
+        """
+        :param time_output_fmt: one of 'rfc3339' (eg. 2017-09-06T13:00:00.000Z) or 'iso8601' (eg. 2017-09-12T11:44:00),
+            or any other strftime format
+        """
+        self.time_output_fmt = time_output_fmt
+        self._cache = {}
+        if time_output_fmt == RFC3339:
+            self._render = _render_rfc3339
+        elif time_output_fmt == ISO8601:
+            self._render = _render_iso8601
+        else:
+            self._render = lambda key: key_to_datetime(key).strftime(time_output_fmt)
+
+    def format(self, key):
+        """
+        :param key: integer UTC epoch milliseconds
+        :return: the formatted time string
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            text = self._cache[key] = self._render(key)
+            return text
+
+
+def _render_rfc3339(key):
+    dt = key_to_datetime(key)
+    return "%04d-%02d-%02dT%02d:%02d:%02d.%03dZ" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second,
+                                                    dt.microsecond // 1000)
+
+
+def _render_iso8601(key):
+    dt = key_to_datetime(key)
+    return "%04d-%02d-%02dT%02d:%02d:%02d" % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
@@ -0,0 +1,157 @@
+"""
+Reconciliation of source service time stops against a GWC layer's TIME parameter filter.
+
+All time values are normalized once to integer UTC epoch milliseconds ('keys') so that the diff between the source
+and the GWC filter is a linear pass of hashed/range membership tests over the sorted filter keys, rather than repeated
+list membership tests and re-parsing of the filter's <string> values.  Source time stops may be a timeranges.TimeSet,
+whose periodic ranges are only expanded across the gaps between existing filter keys.
+"""
+import hashlib
+from collections import namedtuple
+
+from . import timecodec, timeranges
+
+# add: keys present in the source but not in the GWC filter (new timestops to add and seed)
+# remove: keys present in the GWC filter but no longer in the source (expired, to remove and truncate)
+# remain: keys present in both
+# default: latest valid key after the update (new <defaultValue>), or None if there are no valid times
+Reconciliation = namedtuple('Reconciliation', ['add', 'remove', 'remain', 'default'])
+
+# what an update has to change in the GWC layer, see classify():
+UNCHANGED = "unchanged"
+DEFAULT_CHANGED = "default"
+FILTER_CHANGED = "filter"
+
+
+def fingerprint(keys):
+    """
+    :param keys: iterable of epoch keys, or a timeranges.TimeSet
+    :return: hex digest identifying the set of keys, independent of order and duplicates
+    """
+    if not isinstance(keys, timeranges.TimeSet):
+        keys = timeranges.TimeSet(keys)
+    return hashlib.sha1(keys.canonical().encode("ascii")).hexdigest()
+
+
+def index_filter_values(time_values):
+    """
+    Parse each <string> child of a GWC parameter filter <values> element exactly once.
+
+    :param time_values: lxml <values> element of the TIME stringParameterFilter
+    :return: dict mapping epoch key -> list of <string> elements holding that time (more than one only if the filter
+        contains duplicate times, possibly in different formats)
+    """
+    children = list(time_values.iter("string"))
+    filter_index = {}
+    for key, child in zip(timecodec.parse_many(child.text for child in children), children):
+        filter_index.setdefault(key, []).append(child)
+    return filter_index
+
+
+def reconcile(source_keys, filter_keys):
+    """
+    Diff the source time stops against the GWC filter times.
+
+    :param source_keys: timeranges.TimeSet, or iterable of epoch keys, advertised by the source service
+    :param filter_keys: iterable of epoch keys currently in the GWC TIME parameter filter
+    :return: a Reconciliation of sorted (ascending) key lists and the new default key
+    """
+    if not isinstance(source_keys, timeranges.TimeSet):
+        source_keys = timeranges.TimeSet(source_keys)
+    existing = sorted(set(filter_keys))
+
+    remove, remain = [], []
+    for key in existing:
+        if key in source_keys:
+            remain.append(key)
+        else:
+            remove.append(key)
+    add = list(source_keys.missing(existing))
+
+    # every valid time is a source time, so the latest source time is the new default:
+    default = source_keys.last()
+
+    return Reconciliation(add, remove, remain, default)
+
+
+def retain(source_keys, max_count=None, max_age=None):
+    """
+    Limit the source time stops to a retention window ending at the newest one, so the GWC filter stays a fixed size
+    and the times falling out of the window are removed (and truncated) like expired ones.
+
+    :param source_keys: timeranges.TimeSet, or iterable of epoch keys, advertised by the source service
+    :param max_count: keep at most this many of the newest times.  Default: no limit
+    :param max_age: ISO8601 duration (eg. P7D, PT6H), keep only the times within it of the newest.  Default: no limit
+    :return: timeranges.TimeSet of the retained keys
+    :raises ValueError: if max_count is less than 1 or max_age isn't an ISO8601 duration
+    """
+    if not isinstance(source_keys, timeranges.TimeSet):
+        source_keys = timeranges.TimeSet(source_keys)
+    newest = source_keys.last()
+    if newest is None or (max_count is None and not max_age):
+        return source_keys
+
+    start = None
+    if max_age:
+        step, calendar_step = timeranges.parse_period(max_age)
+        if calendar_step is None:
+            start = newest - step
+        else:
+            start = timecodec.epoch_key(timecodec.key_to_datetime(newest) - calendar_step)
+    if max_count is not None:
+        if max_count < 1:
+            raise ValueError("Invalid retention count: {count}".format(count=max_count))
+        nth_last = source_keys.nth_last(max_count)
+        if nth_last is not None:
+            start = nth_last if start is None else max(start, nth_last)
+    return source_keys.since(start) if start is not None else source_keys
+
+
+def apply_reconciliation(time_values, time_value_default, filter_index, result, formatter):
+    """
+    Update the GWC TIME parameter filter XML elements in place to reflect a Reconciliation.
+
+    :param time_values: lxml <values> element of the TIME stringParameterFilter
+    :param time_value_default: lxml <defaultValue> element of the TIME stringParameterFilter
+    :param filter_index: dict of epoch key -> <string> elements, as returned by index_filter_values()
+    :param result: the Reconciliation to apply
+    :param formatter: timecodec.Formatter used to write new time values
+    """
+    for key in result.remove:
+        for child in filter_index.get(key, ()):
+            time_values.remove(child)
+
+    for key in result.add:
+        child = time_values.makeelement("string", {})
+        child.text = formatter.format(key)
+        time_values.append(child)
+
+    if result.default is not None:
+        time_value_default.text = formatter.format(result.default)
+
+
+def default_key(time_value_default):
+    """
+    :param time_value_default: lxml <defaultValue> element of the TIME stringParameterFilter (or None)
+    :return: epoch key of the current default time, or None if it's missing or not a time
+    """
+    if time_value_default is None or not (time_value_default.text or "").strip():
+        return None
+    try:
+        return timecodec.parse(time_value_default.text)
+    except (ValueError, OverflowError):
+        return None
+
+
+def classify(result, current_default):
+    """
+    :param result: the Reconciliation of the source against the GWC filter
+    :param current_default: epoch key of the filter's current <defaultValue>, see default_key()
+    :return: FILTER_CHANGED if times are added or removed, DEFAULT_CHANGED if only the <defaultValue> moves, or
+        UNCHANGED if the GWC layer is already up to date
+    """
+    if result.add or result.remove:
+        return FILTER_CHANGED
+    if result.default != current_default:
+        return DEFAULT_CHANGED
+    return UNCHANGED
@@ -0,0 +1,230 @@
+"""
+Compact representation of source time stops that may include ISO8601 'start/end/period' intervals.
+
+WMS servers often advertise a time dimension as periodic intervals (eg. 2017-01-01T00:00:00Z/2017-12-31T23:55:00Z/PT5M)
+rather than as a list of every time.  A TimeSet keeps those as TimeRanges of epoch keys and only expands them lazily,
+so membership tests and the diff against the GWC filter don't need to materialize every time step.
+"""
+import heapq
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from . import timecodec
+
+logger = logging.getLogger(__name__)
+
+_PERIOD_RE = re.compile(r'^P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?'
+                        r'(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:[.,]\d+)?)S)?)?$')
+
+
+class TimeRange(namedtuple('TimeRange', ['start', 'end', 'step'])):
+    """
+    Periodic range of epoch keys: start, start + step, ... up to and including end (if on the step)
+    """
+    __slots__ = ()
+
+    @property
+    def last(self):
+        """
+        :return: the last key in the range
+        """
+        return self.start + (self.end - self.start) // self.step * self.step
+
+    def includes(self, key):
+        """
+        :param key: epoch key
+        :return: True if key is one of the range's steps
+        """
+        return self.start <= key <= self.end and (key - self.start) % self.step == 0
+
+    def expand(self):
+        """
+        :return: iterator over every key in the range, ascending
+        """
+        return iter(range(self.start, self.last + 1, self.step))
+
+
+class TimeSet(object):
+    """
+    Set of source time stops, held as explicit keys plus TimeRanges that are only expanded on iteration
+    """
+
+    def __init__(self, keys=(), ranges=()):
+        """
+        :param keys: iterable of explicit epoch keys
+        :param ranges: iterable of TimeRange
+        """
+        self.keys = sorted(set(keys))
+        self.ranges = sorted(ranges)
+        self._key_set = set(self.keys)
+
+    def __contains__(self, key):
+        return key in self._key_set or any(time_range.includes(key) for time_range in self.ranges)
+
+    def __bool__(self):
+        return bool(self.keys or self.ranges)
+
+    __nonzero__ = __bool__  # Python 2
+
+    def __iter__(self):
+        """
+        :return: iterator over every key in the set, ascending and without duplicates
+        """
+        return _unique(heapq.merge(self.keys, *[time_range.expand() for time_range in self.ranges]))
+
+    def size(self):
+        """
+        :return: number of keys in the set, without expanding the ranges (keys shared by overlapping ranges or
+            explicit keys are counted once for each)
+        """
+        return len(self.keys) + sum((time_range.last - time_range.start) // time_range.step + 1
+                                    for time_range in self.ranges)
+
+    def last(self):
+        """
+        :return: the latest key in the set, or None if it's empty
+        """
+        lasts = [time_range.last for time_range in self.ranges]
+        if self.keys:
+            lasts.append(self.keys[-1])
+        return max(lasts) if lasts else None
+
+    def since(self, start):
+        """
+        :param start: epoch key
+        :return: a TimeSet of the keys of this set at or after start, without expanding the ranges
+        """
+        ranges = []
+        for time_range in self.ranges:
+            if time_range.last < start:
+                continue
+            if time_range.start < start:
+                # move the start up to the range's first step at or after start:
+                steps = -(-(start - time_range.start) // time_range.step)
+                time_range = TimeRange(time_range.start + steps * time_range.step, time_range.end, time_range.step)
+            ranges.append(time_range)
+        return TimeSet(self.keys[bisect_left(self.keys, start):], ranges)
+
+    def nth_last(self, n):
+        """
+        :param n: position from the end, 1 for the latest key
+        :return: the n-th latest key in the set, or None if it has fewer keys
+        """
+        # walk the keys and ranges backwards (negated, so they merge ascending), expanding only the n latest steps:
+        descending = [(-key for key in reversed(self.keys))]
+        descending.extend((-key for key in range(time_range.last, time_range.start - 1, -time_range.step))
+                          for time_range in self.ranges)
+        for i, key in enumerate(_unique(heapq.merge(*descending))):
+            if i == n - 1:
+                return -key
+        return None
+
+    def missing(self, existing):
+        """
+        Find the keys of this set that aren't in existing, expanding ranges only across the gaps between existing keys
+
+        :param existing: sorted list of epoch keys
+        :return: iterator over the keys of this set not in existing, ascending and without duplicates
+        """
+        existing_set = set(existing)
+        sources = [(key for key in self.keys if key not in existing_set)]
+        for time_range in self.ranges:
+            sources.append(_range_gaps(time_range, existing))
+        return _unique(heapq.merge(*sources))
+
+    def canonical(self):
+        """
+        :return: string identifying the set's explicit keys and ranges, without expanding the ranges
+        """
+        return ",".join([str(key) for key in self.keys] +
+                        ["{start}/{end}/{step}".format(start=start, end=end, step=step) for start, end, step in self.ranges])
+
+
+def _range_gaps(time_range, existing):
+    # the existing keys on this range's steps, in order:
+    lo, hi = bisect_left(existing, time_range.start), bisect_right(existing, time_range.end)
+    members = [key for key in existing[lo:hi] if time_range.includes(key)]
+
+    previous = time_range.start - time_range.step
+    for key in members:
+        for missing in range(previous + time_range.step, key, time_range.step):
+            yield missing
+        previous = key
+    for missing in range(previous + time_range.step, time_range.last + 1, time_range.step):
+        yield missing
+
+
+def _unique(keys):
+    previous = None
+    for key in keys:
+        if key != previous:
+            yield key
+            previous = key
+
+
+def parse_positions(positions):
+    """
+    :param positions: iterable of WMS time position strings: single times, or ISO8601 'start/end/period' intervals
+    :return: a TimeSet of the positions, with fixed length periods kept as (unexpanded) TimeRanges
+    """
+    texts, keys, ranges = [], [], []
+    for position in positions:
+        if "/" not in position:
+            texts.append(position)
+            continue
+
+        parts = [part.strip() for part in position.split("/")]
+        if len(parts) != 3 or not parts[2]:
+            logger.warning("Ignoring time interval without a period, its time stops can't be listed: {position}".format(
+                position=position))
+            continue
+        start, end = timecodec.parse(parts[0]), timecodec.parse(parts[1])
+        if end < start:
+            logger.warning("Ignoring time interval ending before it starts: {position}".format(position=position))
+            continue
+        step, calendar_step = parse_period(parts[2])
+        if calendar_step is None:
+            ranges.append(TimeRange(start, end, step))
+        else:
+            # month/year periods don't have a fixed length, expand them (there are few of them anyway):
+            keys.extend(_expand_calendar(start, end, calendar_step))
+
+    keys.extend(timecodec.parse_many(texts))
+    return TimeSet(keys, ranges)
+
+
+def parse_period(text):
+    """
+    :param text: ISO8601 duration, eg. PT5M, PT1H, P1D
+    :return: tuple of (period in milliseconds, None) for fixed length periods, or (None, relativedelta) for periods
+        with years or months
+    :raises ValueError: if text isn't an ISO8601 duration, or is zero length
+    """
+    match = _PERIOD_RE.match(text.upper())
+    if match is None or not any(match.groups()):
+        raise ValueError("Invalid ISO8601 period: {period}".format(period=text))
+    years, months, weeks, days, hours, minutes = [int(value or 0) for value in match.groups()[:6]]
+    seconds = float((match.group(7) or "0").replace(",", "."))
+
+    if years or months:
+        from dateutil.relativedelta import relativedelta
+        return None, relativedelta(years=years, months=months, weeks=weeks, days=days, hours=hours, minutes=minutes,
+                                   seconds=int(seconds))
+    step = int(round(((((weeks * 7 + days) * 24 + hours) * 60 + minutes) * 60 + seconds) * 1000))
+    if step <= 0:
+        raise ValueError("Invalid ISO8601 period: {period}".format(period=text))
+    return step, None
+
+
+def _expand_calendar(start, end, period):
+    begin = timecodec.key_to_datetime(start)
+    current, i = begin, 0
+    while True:
+        key = timecodec.epoch_key(current)
+        if key > end:
+            break
+        yield key
+        i += 1
+        current = begin + period * i
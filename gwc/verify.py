@@ -0,0 +1,162 @@
+"""
+Verification that the tiles an update seeded are cached and served quickly.
+
+For every seeded TIME value (and the default cache), a random sample of tiles is drawn across the seed jobs' gridsets,
+bounds and zoom levels and requested concurrently from GWC's WMTS endpoint.  GWC reports whether it served a tile from
+the cache in its 'geowebcache-cache-result' response header (HIT, MISS or WMS for tiles it doesn't cache), so a sample
+yields a cache hit ratio and the latency percentiles of the tile requests, which are checked against thresholds.
+"""
+import logging
+import random
+import time
+from collections import namedtuple
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import seeding
+
+SAMPLES = 20
+WORKERS = 8
+MIN_HIT_RATIO = 0.95
+CACHE_RESULT_HEADER = 'geowebcache-cache-result'
+HIT = 'HIT'
+PERCENTILES = (50, 90, 99)
+
+logger = logging.getLogger(__name__)
+
+# row is counted from the top of the tile matrix, as in WMTS; time_key is None for the default (no TIME) cache
+Tile = namedtuple('Tile', ['gridset', 'zoom', 'row', 'col', 'time_key'])
+
+# cache is the 'geowebcache-cache-result' header (None if missing), error the exception if the request failed
+TileResult = namedtuple('TileResult', ['tile', 'status', 'cache', 'seconds', 'error'])
+
+
+def sample_tiles(jobs, samples=SAMPLES, rng=None):
+    """
+    :param jobs: list of seeding.SeedJob that were seeded
+    :param samples: number of tiles to draw for each TIME value (and the default cache) of jobs
+    :param rng: random.Random to draw with.  Default: a new one
+    :return: list of Tile, samples per TIME value, each on a random job, zoom level and tile of that job's bounds
+    """
+    rng = rng or random.Random()
+    by_time = {}
+    for job in jobs:
+        if seeding.tile_range(job.gridset, job.bounds, job.zoom_start) is None:
+            logger.warning("Unknown tile matrix of gridset: {gridset}, its tiles aren't verified".format(
+                gridset=job.gridset))
+            continue
+        by_time.setdefault(job.time_key, []).append(job)
+
+    tiles = []
+    for time_key in sorted(by_time, key=lambda key: (key is not None, key)):
+        for _ in range(samples):
+            job = rng.choice(by_time[time_key])
+            zoom = rng.randint(job.zoom_start, job.zoom_stop)
+            col_min, col_max, row_min, row_max = seeding.tile_range(job.gridset, job.bounds, zoom)
+            if col_max < col_min or row_max < row_min:
+                continue
+            tiles.append(Tile(job.gridset, zoom, rng.randint(row_min, row_max), rng.randint(col_min, col_max),
+                              time_key))
+    return tiles
+
+
+def tile_params(tile, layer_id, formatter, tile_format=seeding.TILE_FORMAT):
+    """
+    :return: WMTS KVP GetTile parameters for tile of layer_id (GWC names the tile matrices of its gridsets
+        'GRIDSET:ZOOM')
+    """
+    params = {
+        'SERVICE': 'WMTS',
+        'VERSION': '1.0.0',
+        'REQUEST': 'GetTile',
+        'LAYER': layer_id,
+        'STYLE': '',
+        'TILEMATRIXSET': tile.gridset,
+        'TILEMATRIX': "{gridset}:{zoom}".format(gridset=tile.gridset, zoom=tile.zoom),
+        'TILEROW': tile.row,
+        'TILECOL': tile.col,
+        'FORMAT': tile_format,
+    }
+    if tile.time_key is not None:
+        params['TIME'] = formatter.format(tile.time_key)
+    return params
+
+
+def fetch_tiles(http_client, url, tiles, layer_id, formatter, tile_format=seeding.TILE_FORMAT, workers=WORKERS):
+    """
+    Request tiles concurrently
+
+    :param http_client: client.HTTPClient to send the requests through
+    :param url: GWC WMTS endpoint, eg. http://localhost:8080/geowebcache/service/wmts
+    :param tiles: list of Tile
+    :param layer_id: GWC layer ID
+    :param formatter: timecodec.Formatter to write TIME parameters with
+    :param tile_format: tile MIME type to request
+    :param workers: maximum number of requests in flight
+    :return: list of TileResult, in the order of tiles
+    """
+    def fetch(tile):
+        start = time.time()
+        try:
+            r = http_client.request("get", url, params=tile_params(tile, layer_id, formatter, tile_format))
+        except Exception as e:
+            response = getattr(e, 'response', None)
+            return TileResult(tile, response.status_code if response is not None else None, None,
+                              time.time() - start, e)
+        return TileResult(tile, r.status_code, r.headers.get(CACHE_RESULT_HEADER), time.time() - start, None)
+
+    if not tiles:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tiles)))) as executor:
+        return list(executor.map(fetch, tiles))
+
+
+def summarize(results):
+    """
+    :param results: list of TileResult
+    :return: dict of 'samples', 'hits', 'misses', 'errors', 'hit_ratio' (None if there were no samples) and the
+        latency percentiles in seconds, 'p50', 'p90' and 'p99' (None if no request succeeded)
+    """
+    hits = len([result for result in results if result.error is None and (result.cache or '').upper() == HIT])
+    errors = len([result for result in results if result.error is not None])
+    latencies = sorted(result.seconds for result in results if result.error is None)
+    report = {
+        'samples': len(results),
+        'hits': hits,
+        'misses': len(results) - hits - errors,
+        'errors': errors,
+        'hit_ratio': float(hits) / len(results) if results else None,
+    }
+    for percent in PERCENTILES:
+        report['p{percent}'.format(percent=percent)] = percentile(latencies, percent)
+    return report
+
+
+def percentile(values, percent):
+    """
+    :param values: sorted list of numbers
+    :param percent: percentile, 0-100
+    :return: the nearest-rank percentile of values, or None if values is empty
+    """
+    if not values:
+        return None
+    rank = max(1, int(-(-percent * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]
+
+
+def check(report, min_hit_ratio=MIN_HIT_RATIO, max_latency=None, latency_percentile=PERCENTILES[1]):
+    """
+    :param report: dict from summarize()
+    :param min_hit_ratio: lowest acceptable cache hit ratio
+    :param max_latency: highest acceptable latency (seconds) at latency_percentile.  Default: not checked
+    :param latency_percentile: percentile max_latency applies to, one of PERCENTILES
+    :return: list of the failed checks' descriptions, empty if the sample passed
+    """
+    failures = []
+    if report['samples'] and report['hit_ratio'] < min_hit_ratio:
+        failures.append("hit ratio {ratio:.2f} below {min:.2f}".format(ratio=report['hit_ratio'], min=min_hit_ratio))
+    latency = report['p{percent}'.format(percent=latency_percentile)]
+    if max_latency is not None and latency is not None and latency > max_latency:
+        failures.append("p{percent} latency {latency:.3f}s above {max}s".format(
+            percent=latency_percentile, latency=latency, max=max_latency))
+    return failures
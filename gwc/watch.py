@@ -0,0 +1,186 @@
+"""
+Watch mode: stay resident and poll each layer's source service on its own interval, only running the GWC layer
+update (XML POST, truncate and seed) when the set of source time stops actually changed.
+
+Takes the same JSON config file as batch mode (see gwc.batch), with an optional 'interval' (seconds) per layer or in
+'defaults'.  LayerInfo sources are polled with conditional requests (ETag/Last-Modified), and every source's time
+stops are compared by fingerprint against those last applied to GWC.
+"""
+import argparse
+import heapq
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import batch, client, gwc, metrics, timeindex
+
+INTERVAL = 300
+
+logger = logging.getLogger(__name__)
+
+
+class LayerWatch(object):
+    """
+    Change detection state for a single watched layer
+    """
+
+    def __init__(self, args, interval):
+        """
+        :param args: argparse.Namespace holding the layer's options, see gwc.build_parser()
+        :param interval: seconds between polls of the layer's source service
+        """
+        self.args = args
+        self.interval = interval
+        # fingerprint of the time stops last successfully applied to GWC, and the LayerInfo response validators
+        # that go with them:
+        self.fingerprint = None
+        self.etag = None
+        self.last_modified = None
+
+    def poll(self, http_client):
+        """
+        Query the source service and update the GWC layer if its time stops changed since the last update
+
+        :param http_client: client.HTTPClient to send requests through
+        :return: dict summarizing the update from gwc.update_layer(), or None if the source was unchanged
+        """
+        etag, last_modified = None, None
+        recorder = metrics.Recorder(self.args.layer_id)
+        if self.args.wms_url is not None:
+            timestops = gwc.fetch_timestops(self.args, http_client, recorder=recorder)
+        else:
+            headers = {}
+            if self.fingerprint is not None:
+                if self.etag:
+                    headers['If-None-Match'] = self.etag
+                if self.last_modified:
+                    headers['If-Modified-Since'] = self.last_modified
+            with recorder.phase(metrics.SOURCE_QUERY) as phase:
+                r = gwc.query_layerinfo(self.args, http_client, headers=headers)
+                phase.update(status=r.status_code, bytes=len(r.content))
+            if r.status_code == 304:
+                logger.info("LayerInfo not modified for GWC layer: {layer}".format(layer=self.args.layer_id))
+                return None
+            etag, last_modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+            with recorder.phase(metrics.SOURCE_PARSE) as phase:
+                timestops = gwc.parse_layerinfo(r, nc_layer=gwc.nc_layer(self.args))
+                phase.update(timestops=len(timestops))
+
+        fingerprint = timeindex.fingerprint(timestops)
+        if fingerprint == self.fingerprint:
+            logger.info("Time stops unchanged for GWC layer: {layer}".format(layer=self.args.layer_id))
+            self.etag, self.last_modified = etag, last_modified
+            return None
+
+        result = gwc.update_layer(self.args, http_client=http_client, timestops=timestops, recorder=recorder)
+        # only remember what was actually applied, so a failed update is retried on the next poll:
+        self.fingerprint, self.etag, self.last_modified = fingerprint, etag, last_modified
+        return result
+
+
+def main(argv=None):
+    """
+    Command line interface for 'gwc watch'
+    """
+    kwargs = {
+        'prog': 'gwc watch',
+        'description': 'Poll the sources of the GWC layers listed in a JSON config file and update a layer\'s time '
+                       'parameter filter whenever its source time stops change.',
+        'formatter_class': argparse.RawDescriptionHelpFormatter,
+    }
+    parser = argparse.ArgumentParser(**kwargs)
+    parser.add_argument('config', type=str,
+                        help='JSON config file mapping GWC layer IDs to their WMS or LayerInfo sources (see gwc batch)')
+    parser.add_argument('-i', '--interval', type=float, default=INTERVAL, required=False,
+                        help='Default seconds between polls of each layer\'s source.  Default: {interval}'.format(
+                            interval=INTERVAL))
+    parser.add_argument('-w', '--workers', type=int, default=batch.WORKERS, required=False,
+                        help='Maximum number of layers to poll/update concurrently.  Default: {workers}'.format(
+                            workers=batch.WORKERS))
+    parser.add_argument('--log_file', type=str, default=gwc.LOG, required=False,
+                        help='Log file to append to.  Default: {log}'.format(log=gwc.LOG))
+    args = parser.parse_args(argv)
+    gwc.configure_logging(args.log_file)
+
+    try:
+        _, layers = batch.load_config(args.config, extra_options={'interval': float})
+    except (IOError, ValueError) as e:
+        print("Unable to read watch config file: {file}.  Err: {err}".format(file=args.config, err=e))
+        exit(1)
+
+    watches = [LayerWatch(layer, getattr(layer, 'interval', args.interval)) for layer in layers]
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    http_clients = batch.HTTPClients(layers, pool_size=max(client.POOL_SIZE, args.workers))
+    try:
+        run_watch(watches, stop, workers=args.workers, http_client=http_clients)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_clients.close()
+
+
+def run_watch(watches, stop, workers=batch.WORKERS, http_client=None):
+    """
+    Poll each watched layer on its own interval until stop is set
+
+    :param watches: list of LayerWatch
+    :param stop: threading.Event, set to stop scheduling polls and shut down once the polls in progress complete
+    :param workers: maximum number of layers to poll/update concurrently
+    :param http_client: client.HTTPClient shared by every layer, or batch.HTTPClients to pick each layer's client
+        from.  Default: the shared default client
+    """
+    if http_client is None:
+        http_client = client.default_client()
+
+    # schedule of (next poll time, index into watches), all layers are polled once at startup:
+    now = time.time()
+    schedule = [(now, i) for i in range(len(watches))]
+    heapq.heapify(schedule)
+    # polls in progress, future -> (due, index); a layer is rescheduled once its poll completes:
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while (schedule or in_flight) and not stop.is_set():
+            while schedule and schedule[0][0] <= time.time():
+                due, i = heapq.heappop(schedule)
+                layer_client = batch.layer_client(http_client, watches[i].args)
+                in_flight[executor.submit(_poll, watches[i], layer_client)] = (due, i)
+
+            # sleep until the next layer is due or a poll completes, waking at least once a second to check stop:
+            timeout = min(max(0, schedule[0][0] - time.time()), 1) if schedule else 1
+            if in_flight:
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                done = ()
+                stop.wait(timeout)
+
+            for future in done:
+                due, i = in_flight.pop(future)
+                # keep to the interval, but don't try to catch up on polls missed while a slow update ran:
+                heapq.heappush(schedule, (max(due + watches[i].interval, time.time()), i))
+
+
+def _poll(watch, http_client):
+    layer_id = watch.args.layer_id
+    start = time.time()
+    try:
+        result = watch.poll(http_client)
+    except Exception as e:
+        if isinstance(e, gwc.UpdateError):
+            logger.error("Watch poll failed for GWC layer: {layer}.  Err: {err}".format(layer=layer_id, err=e))
+        else:
+            logger.exception("Watch poll failed for GWC layer: {layer}".format(layer=layer_id))
+        print("{layer}: FAILED in {elapsed:.1f}s.  Err: {type}: {err}".format(layer=layer_id, elapsed=time.time() - start,
+                                                                           type=type(e).__name__, err=e))
+        return
+    if result is None:
+        print("{layer}: unchanged".format(layer=layer_id))
+    else:
+        print("{layer}: {path} in {elapsed:.1f}s.  added: {added}, removed: {removed}, default: {default}".format(
+            layer=layer_id, path=result['path'], elapsed=time.time() - start, added=result['added'], removed=result['removed'],
+            default=result['default']))
@@ -0,0 +1,56 @@
+"""
+Tests of merging layer updates into a shared Prometheus textfile (gwc.metrics).
+"""
+from gwc import metrics
+
+
+def record(layer_id, status, node=None, error=None):
+    recorder = metrics.Recorder(layer_id)
+    with recorder.phase(metrics.GWC_GET, node=node) as phase:
+        phase['status'] = status
+    recorder.finish(error)
+    return recorder
+
+
+def samples(filename):
+    return [line for line in open(filename).read().splitlines() if not line.startswith('#')]
+
+
+def test_update_replaces_only_the_layers_own_series(tmpdir):
+    prom = str(tmpdir.join('gwc.prom'))
+
+    # separate runs sharing one file, eg. one cron job per layer:
+    metrics.export(record('ns:a', 200), prometheus=prom)
+    metrics.export(record('ns:b', 404, node='http://gwc1/"x"', error=ValueError()), prometheus=prom)
+    metrics.export(record('ns:a', 500), prometheus=prom)
+
+    lines = samples(prom)
+    assert 'gwc_update_phase_http_status{layer="ns:a",phase="gwc_get"} 500' in lines
+    assert 'gwc_update_phase_http_status{layer="ns:a",phase="gwc_get"} 200' not in lines
+    assert 'gwc_update_phase_http_status{layer="ns:b",phase="gwc_get",node="http://gwc1/\\"x\\""} 404' in lines
+    assert 'gwc_update_last_run_success{layer="ns:a"} 1' in lines
+    assert 'gwc_update_last_run_success{layer="ns:b"} 0' in lines
+    assert len([line for line in lines if line.startswith('gwc_update_last_run_timestamp_seconds')]) == 2
+    assert sorted(tmpdir.listdir()) == [tmpdir.join('gwc.prom'), tmpdir.join('gwc.prom.lock')]
+
+
+def test_each_file_only_gets_the_layers_exported_to_it(tmpdir):
+    metrics.export(record('ns:a', 200), prometheus=str(tmpdir.join('a.prom')))
+    metrics.export(record('ns:b', 200), prometheus=str(tmpdir.join('b.prom')))
+
+    assert all('layer="ns:a"' in line for line in samples(str(tmpdir.join('a.prom'))))
+    assert all('layer="ns:b"' in line for line in samples(str(tmpdir.join('b.prom'))))
+
+
+def test_series_are_grouped_under_one_help_per_metric(tmpdir):
+    prom = str(tmpdir.join('gwc.prom'))
+
+    metrics.export(record('ns:b', 200), prometheus=prom)
+    metrics.export(record('ns:a', 200), prometheus=prom)
+
+    text = open(prom).read()
+    assert text.count('# HELP gwc_update_phase_duration_seconds ') == 1
+    durations = [line for line in samples(prom) if line.startswith('gwc_update_phase_duration_seconds')]
+    # sorted by layer, each layer's phases in pipeline order:
+    assert [line.split('"')[1:4:2] for line in durations] == [['ns:a', metrics.GWC_GET], ['ns:a', metrics.TOTAL],
+                                                              ['ns:b', metrics.GWC_GET], ['ns:b', metrics.TOTAL]]
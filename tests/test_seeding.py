@@ -0,0 +1,26 @@
+"""
+Tests of seed/truncate job planning (gwc.seeding).
+"""
+import pytest
+
+from gwc import seeding
+
+GRID_SUBSETS = {
+    'EPSG:4326': seeding.GridSubset('EPSG:4326', None, None, None),
+    'EPSG:900913': seeding.GridSubset('EPSG:900913', None, 2, 4),
+}
+
+
+def test_plan_selected_gridsets_newest_first():
+    planner = seeding.Planner(GRID_SUBSETS, gridsets=['EPSG:900913'], seed_zoom='0-5')
+
+    jobs = planner.plan(seeding.SEED, [1, 2])
+
+    assert [(job.gridset, job.zoom_start, job.zoom_stop, job.time_key) for job in jobs] == [
+        ('EPSG:900913', 2, 4, None), ('EPSG:900913', 2, 4, 2), ('EPSG:900913', 2, 4, 1)]
+
+
+@pytest.mark.parametrize('kwargs', [{'gridsets': ['EPSG:3857']}, {'gridset_zooms': {'EPSG:3857': (0, 3)}}])
+def test_unknown_gridsets_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        seeding.Planner(GRID_SUBSETS, **kwargs)
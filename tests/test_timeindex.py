@@ -0,0 +1,91 @@
+"""
+Tests of the diff between source time stops and the GWC TIME filter, and of the retention window (gwc.timeindex).
+"""
+import pytest
+
+from gwc import timecodec, timeindex
+from gwc.timeranges import TimeRange, TimeSet
+
+MINUTE = 60 * 1000
+STEP = 5 * MINUTE
+T0 = timecodec.parse("2017-09-06T13:00:00Z")
+
+
+def test_reconcile_keys():
+    result = timeindex.reconcile([T0 + STEP, T0 + 2 * STEP, T0 + 3 * STEP], [T0, T0 + STEP, T0 + 2 * STEP, T0 + STEP])
+
+    assert result == timeindex.Reconciliation(add=[T0 + 3 * STEP], remove=[T0], remain=[T0 + STEP, T0 + 2 * STEP],
+                                              default=T0 + 3 * STEP)
+
+
+def test_reconcile_range_with_overlapping_keys_and_off_step_filter_times():
+    source = TimeSet([T0 + 2 * STEP, T0 + 6 * STEP], [TimeRange(T0, T0 + 3 * STEP, STEP)])
+    # an off-step time and a time past the range are expired, the rest of the range is added:
+    existing = [T0 + STEP, T0 + 7 * MINUTE, T0 + 2 * STEP, T0 + 5 * STEP]
+
+    result = timeindex.reconcile(source, existing)
+
+    assert result.remove == [T0 + 7 * MINUTE, T0 + 5 * STEP]
+    assert result.remain == [T0 + STEP, T0 + 2 * STEP]
+    assert result.add == [T0, T0 + 3 * STEP, T0 + 6 * STEP]
+    assert result.default == T0 + 6 * STEP
+
+
+def test_reconcile_empty_source_expires_everything():
+    result = timeindex.reconcile(TimeSet(), [T0, T0 + STEP])
+
+    assert result == timeindex.Reconciliation(add=[], remove=[T0, T0 + STEP], remain=[], default=None)
+
+
+def test_classify():
+    unchanged = timeindex.reconcile([T0, T0 + STEP], [T0, T0 + STEP])
+
+    assert timeindex.classify(unchanged, T0 + STEP) == timeindex.UNCHANGED
+    assert timeindex.classify(unchanged, T0) == timeindex.DEFAULT_CHANGED
+    assert timeindex.classify(timeindex.reconcile([T0, T0 + STEP], [T0]), T0) == timeindex.FILTER_CHANGED
+
+
+def test_retain_count_across_ranges():
+    source = TimeSet([T0 + 10 * STEP], [TimeRange(T0, T0 + 3 * STEP, STEP), TimeRange(T0 + 6 * STEP, T0 + 8 * STEP,
+                                                                                      STEP)])
+
+    assert list(timeindex.retain(source, max_count=5)) == [T0 + 3 * STEP, T0 + 6 * STEP, T0 + 7 * STEP,
+                                                           T0 + 8 * STEP, T0 + 10 * STEP]
+    assert list(timeindex.retain(source, max_count=100)) == list(source)
+
+
+def test_retain_age_starts_inside_a_range():
+    source = TimeSet(ranges=[TimeRange(T0, T0 + 12 * STEP, STEP)])
+
+    # 22 minutes before the newest time falls between two steps:
+    assert list(timeindex.retain(source, max_age="PT22M")) == [T0 + 8 * STEP + i * STEP for i in range(5)]
+
+
+def test_retain_smaller_window_wins():
+    source = TimeSet(ranges=[TimeRange(T0, T0 + 12 * STEP, STEP)])
+
+    assert list(timeindex.retain(source, max_count=3, max_age="PT1H")) == [T0 + 10 * STEP, T0 + 11 * STEP,
+                                                                           T0 + 12 * STEP]
+    assert list(timeindex.retain(source, max_count=10, max_age="PT10M")) == [T0 + 10 * STEP, T0 + 11 * STEP,
+                                                                             T0 + 12 * STEP]
+
+
+def test_retain_calendar_age():
+    source = TimeSet(timecodec.parse(text) for text in ("2017-01-31T00:00:00Z", "2017-02-28T00:00:00Z",
+                                                        "2017-03-01T00:00:00Z", "2017-03-31T00:00:00Z"))
+
+    # one month before March 31st is February 28th:
+    assert list(timeindex.retain(source, max_age="P1M")) == [timecodec.parse(text) for text in (
+        "2017-02-28T00:00:00Z", "2017-03-01T00:00:00Z", "2017-03-31T00:00:00Z")]
+
+
+def test_retain_rejects_invalid_windows():
+    with pytest.raises(ValueError):
+        timeindex.retain([T0], max_count=0)
+    with pytest.raises(ValueError):
+        timeindex.retain([T0], max_age="1 day")
+
+
+def test_fingerprint_ignores_order_and_duplicates():
+    assert timeindex.fingerprint([T0 + STEP, T0, T0]) == timeindex.fingerprint([T0, T0 + STEP])
+    assert timeindex.fingerprint([T0]) != timeindex.fingerprint([T0 + STEP])
@@ -0,0 +1,117 @@
+"""
+Tests of the lazy time stop sets behind the diff against the GWC TIME filter (gwc.timeranges).
+"""
+from gwc import timecodec, timeranges
+from gwc.timeranges import TimeRange, TimeSet
+
+MINUTE = 60 * 1000
+STEP = 5 * MINUTE
+
+
+def key(text):
+    return timecodec.parse(text)
+
+
+def keys(*texts):
+    return [key(text) for text in texts]
+
+
+T0 = key("2017-09-06T13:00:00Z")
+
+
+def test_missing_skips_explicit_keys_overlapping_a_range():
+    # explicit keys on and off the range's steps, one of them also in the filter already:
+    times = TimeSet([T0 + STEP, T0 + 7 * MINUTE, T0 + 30 * MINUTE], [TimeRange(T0, T0 + 4 * STEP, STEP)])
+    existing = [T0 + STEP, T0 + 2 * STEP]
+
+    assert list(times.missing(existing)) == [T0, T0 + 7 * MINUTE, T0 + 3 * STEP, T0 + 4 * STEP, T0 + 30 * MINUTE]
+
+
+def test_iteration_counts_overlapping_keys_once():
+    times = TimeSet([T0, T0 + STEP, T0 + 7 * MINUTE], [TimeRange(T0, T0 + 2 * STEP, STEP)])
+
+    assert list(times) == [T0, T0 + STEP, T0 + 7 * MINUTE, T0 + 2 * STEP]
+
+
+def test_missing_ignores_existing_keys_off_the_range_steps():
+    time_range = TimeRange(T0, T0 + 3 * STEP, STEP)
+    existing = [T0 - STEP, T0 + 2 * MINUTE, T0 + STEP, T0 + 12 * MINUTE, T0 + 4 * STEP]
+
+    assert list(TimeSet(ranges=[time_range]).missing(existing)) == [T0, T0 + 2 * STEP, T0 + 3 * STEP]
+    assert T0 + 2 * MINUTE not in TimeSet(ranges=[time_range])
+
+
+def test_range_last_is_the_last_step_before_an_off_step_end():
+    time_range = TimeRange(T0, T0 + 2 * STEP + MINUTE, STEP)
+
+    assert time_range.last == T0 + 2 * STEP
+    assert list(time_range.expand()) == [T0, T0 + STEP, T0 + 2 * STEP]
+    assert not time_range.includes(T0 + 2 * STEP + MINUTE)
+
+
+def test_since_moves_a_range_start_up_to_its_next_step():
+    times = TimeSet([T0 - STEP, T0 + 11 * MINUTE], [TimeRange(T0, T0 + 4 * STEP, STEP)])
+
+    since = times.since(T0 + 7 * MINUTE)
+
+    assert since.ranges == [TimeRange(T0 + 2 * STEP, T0 + 4 * STEP, STEP)]
+    assert list(since) == [T0 + 2 * STEP, T0 + 11 * MINUTE, T0 + 3 * STEP, T0 + 4 * STEP]
+
+
+def test_since_keeps_a_start_on_a_step_and_drops_earlier_ranges():
+    times = TimeSet(ranges=[TimeRange(T0 - 10 * STEP, T0 - STEP, STEP), TimeRange(T0, T0 + 2 * STEP, STEP)])
+
+    assert list(times.since(T0 + STEP)) == [T0 + STEP, T0 + 2 * STEP]
+    assert list(times.since(T0 + 3 * STEP)) == []
+
+
+def test_nth_last_across_several_ranges_and_keys():
+    hour = 60 * MINUTE
+    times = TimeSet([T0 + 2 * hour + STEP, T0 + 3 * hour],
+                    [TimeRange(T0, T0 + 2 * STEP, STEP), TimeRange(T0 + hour, T0 + hour + 20 * MINUTE, 10 * MINUTE)])
+    expected = sorted(times, reverse=True)
+
+    assert expected == [T0 + 3 * hour, T0 + 2 * hour + STEP, T0 + hour + 20 * MINUTE, T0 + hour + 10 * MINUTE,
+                        T0 + hour, T0 + 2 * STEP, T0 + STEP, T0]
+    assert [times.nth_last(n) for n in range(1, len(expected) + 1)] == expected
+    assert times.nth_last(len(expected) + 1) is None
+
+
+def test_nth_last_counts_keys_shared_by_overlapping_ranges_once():
+    times = TimeSet([T0 + 2 * STEP], [TimeRange(T0, T0 + 2 * STEP, STEP), TimeRange(T0, T0 + 4 * STEP, 2 * STEP)])
+
+    assert [times.nth_last(n) for n in range(1, 6)] == [T0 + 4 * STEP, T0 + 2 * STEP, T0 + STEP, T0, None]
+
+
+def test_parse_positions_keeps_fixed_periods_as_ranges():
+    times = timeranges.parse_positions(["2017-09-06T13:00:00Z/2017-09-06T13:20:00Z/PT5M", "2017-09-06T14:00:00Z"])
+
+    assert times.ranges == [TimeRange(T0, T0 + 4 * STEP, STEP)]
+    assert times.keys == keys("2017-09-06T14:00:00Z")
+    assert times.last() == key("2017-09-06T14:00:00Z")
+
+
+def test_parse_positions_expands_calendar_periods():
+    times = timeranges.parse_positions(["2017-01-31T00:00:00Z/2017-05-31T00:00:00Z/P1M",
+                                        "2016-02-29T00:00:00Z/2018-03-01T00:00:00Z/P1Y"])
+
+    assert times.ranges == []
+    # each step is counted from the start, so short months don't shift the later ones:
+    assert list(times) == keys("2016-02-29T00:00:00Z", "2017-01-31T00:00:00Z", "2017-02-28T00:00:00Z",
+                               "2017-03-31T00:00:00Z", "2017-04-30T00:00:00Z", "2017-05-31T00:00:00Z",
+                               "2018-02-28T00:00:00Z")
+
+
+def test_parse_positions_skips_reversed_intervals():
+    times = timeranges.parse_positions(["2017-01-01T00:00:00Z/2016-12-31T23:55:00Z/PT5M",
+                                        "2017-01-01T00:00:00Z/2016-12-01T00:00:00Z/P1M"])
+
+    assert not times
+    assert times.last() is None
+    assert times.size() == 0
+
+
+def test_parse_positions_skips_intervals_without_a_period():
+    times = timeranges.parse_positions(["2017-09-06T13:00:00Z/2017-09-06T14:00:00Z", "2017-09-06T13:00:00Z"])
+
+    assert list(times) == [T0]